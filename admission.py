@@ -0,0 +1,112 @@
+# Admission control ahead of JWT verification: token-bucket rate limits per
+# caller and a cap on the requests handled at once, with pluggable storage
+# for the buckets
+
+import math
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class BucketBackend():
+    """Interface for the storage of token buckets. A shared store such as
+    Redis lets every process draw on the same buckets, by implementing
+    take() as one atomic operation, such as a Lua script
+    """
+
+    def take(self, key, rate, burst):
+        """Take one token from the bucket for key, which refills at rate
+        tokens a second and holds at most burst tokens
+
+        Return 0 if a token was taken, or else the seconds until the next
+        one will be
+        """
+        raise NotImplementedError
+
+
+class MemoryBucketBackend(BucketBackend):
+    def __init__(self, max_keys=100000):
+        """Initializes an in-process store of at most max_keys buckets. The
+        least recently used bucket is dropped first, which at worst gives
+        its caller a full bucket again
+        """
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class AdmissionControl():
+    def __init__(self, backend=None, limits=None, max_in_flight=0):
+        """Initializes admission control with token buckets in backend.
+        limits maps a scope, such as 'subject' or 'ip', to a (rate, burst)
+        tuple, and a scope with a rate of 0 is not limited. At most
+        max_in_flight requests are admitted at once in this process, or any
+        number if it is 0
+        """
+        self.backend = (backend if backend is not None
+                        else MemoryBucketBackend())
+        self.limits = limits if limits is not None else {}
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.rejections = {}
+        self._lock = threading.Lock()
+
+    def _reject(self, reason):
+        with self._lock:
+            self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+    def limit(self, scope, key):
+        """Take a token from the bucket of key in scope
+
+        Return 0 if the request may go ahead, or else the seconds the
+        caller should wait before trying again
+        """
+        rate, burst = self.limits.get(scope, (0, 0))
+        if rate <= 0 or key is None:
+            return 0
+        wait = self.backend.take(scope + ':' + str(key), rate,
+                                 max(burst, 1))
+        if wait > 0:
+            self._reject(scope)
+        return wait
+
+    def enter(self):
+        """Count a request as in flight, unless max_in_flight are already.
+        Every request entered must leave()
+
+        Return True if the request was admitted
+        """
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.rejections['in_flight'] = (
+                    self.rejections.get('in_flight', 0) + 1)
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        """Stop counting a request admitted by enter() as in flight"""
+        with self._lock:
+            self.in_flight -= 1
+
+
+def retry_after(wait):
+    """Return the Retry-After header value for a wait in seconds"""
+    return str(max(1, math.ceil(wait)))
@@ -0,0 +1,104 @@
+# Benchmark: latency of a well-behaved tenant while another client floods
+# the API with forged tokens, with admission control off and on
+#
+# Requires the Datastore emulator (see bench_pagination.py). The flooding
+# client is told apart by its X-Forwarded-For address, so the app runs with
+# TRUSTED_PROXIES=1. Forged tokens are never cached, so each one fails a
+# full RS256 check unless its request is turned away first.
+#
+# Usage: python bench/bench_admission.py [flood_threads] [requests]
+
+import os
+import sys
+import threading
+import time
+
+import requests
+
+import loadtest
+import stub_auth0
+
+
+def flood(url, headers, stop):
+    """Send requests until stop is set"""
+    session = requests.Session()
+    while not stop.is_set():
+        session.get(url, headers=headers)
+
+
+def tenant_latencies(url, headers, count):
+    """Send count requests one after another
+
+    Return a tuple of (status code counts, ms of the successful requests)
+    """
+    session = requests.Session()
+    statuses = {}
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        resp = session.get(url, headers=headers)
+        spent = (time.perf_counter() - start) * 1000
+        statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+        if resp.status_code == 200:
+            latencies.append(spent)
+    return statuses, latencies
+
+
+def main_bench():
+    flood_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    os.environ['TRUSTED_PROXIES'] = '1'
+    issuer = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID'])
+    app_url, main = loadtest.start_app(issuer.serve())
+
+    tenant = {'Authorization': 'Bearer ' + issuer.mint('auth0|tenant'),
+              'Accept': 'application/json',
+              'X-Forwarded-For': '10.0.0.1'}
+    boat = requests.post(app_url + '/boats', headers=tenant,
+                         json={'name': 'steady', 'type': 'Sloop',
+                               'length': 30}).json()
+    forged = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID']).mint(
+                                       'auth0|tenant')
+    attacker = {'Authorization': 'Bearer ' + forged,
+                'Accept': 'application/json',
+                'X-Forwarded-For': '10.0.0.66'}
+    url = app_url + '/boats/%s' % boat['id']
+
+    print('%-10s %10s %10s  %s' % ('admission', 'p50 ms', 'p99 ms',
+                                   'tenant statuses'))
+    for name, limits in (('off', {}),
+                         ('on', {'subject': (50, 100), 'ip': (5, 10)})):
+        main.admission_control.limits = limits
+        stop = threading.Event()
+        flooders = [threading.Thread(target=flood,
+                                     args=(url, attacker, stop))
+                    for _ in range(flood_threads)]
+        for thread in flooders:
+            thread.start()
+        statuses, latencies = tenant_latencies(url, tenant, count)
+        stop.set()
+        for thread in flooders:
+            thread.join()
+        print('%-10s %10.2f %10.2f  %s' % (
+            name, loadtest.percentile(latencies, 50),
+            loadtest.percentile(latencies, 99),
+            dict(sorted(statuses.items()))))
+
+    print()
+    metrics_text = requests.get(app_url + '/metrics',
+                                headers=loadtest.METRICS_HEADERS).text
+    for line in metrics_text.splitlines():
+        if line.startswith('app_admission_rejections_total{'):
+            print(line)
+    issuer.shutdown()
+
+
+if __name__ == '__main__':
+    main_bench()
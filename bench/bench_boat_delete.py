@@ -0,0 +1,96 @@
+# Benchmark: boat DELETE cascade, one transaction per load vs. batched
+# put_multi in main.delete_boat
+#
+# Requires the Datastore emulator (see bench_pagination.py). Each row gives
+# the latency of one DELETE cascade, its throughput in loads unloaded a
+# second, and the datastore calls the batched cascade made, which set its
+# latency against the production datastore.
+#
+# Usage: python bench/bench_boat_delete.py [load counts...]
+
+import os
+import sys
+import time
+
+from google.cloud import datastore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import const  # noqa: E402
+import main  # noqa: E402
+import metrics  # noqa: E402
+
+
+def make_boat(client, num_loads):
+    """Create a boat carrying num_loads loads and return the boat entity"""
+    boat = datastore.Entity(key=client.key(const.BOATS))
+    boat.update({'name': 'bench', 'type': 'Barge', 'length': 99,
+                 'owner': 'auth0|bench', 'loads': []})
+    client.put(boat)
+    loads = []
+    for i in range(num_loads):
+        load = datastore.Entity(key=client.key(const.LOADS))
+        load.update({'volume': i, 'item': 'cargo %d' % i,
+                     'creation_date': '06/11/2023', 'carrier': boat.key.id})
+        loads.append(load)
+    for batch in main.batched(loads):
+        client.put_multi(batch)
+    boat['loads'] = [load.key.id for load in loads]
+    client.put(boat)
+    return boat
+
+
+def delete_boat_per_load(client, boat):
+    """The cascade as it was before batching"""
+    query = client.query(kind=const.LOADS)
+    query.add_filter('carrier', '=', boat.key.id)
+    loads = list(query.fetch())
+    for i in range(len(loads)):
+        with client.transaction():
+            loads[i]['carrier'] = None
+            client.put(loads[i])
+    client.delete(boat)
+
+
+def delete_boat_batched(boat):
+    """Run main.delete_boat in a request context, so its datastore calls are
+    counted the way Server-Timing counts them
+
+    Return a dictionary of phase name to number of calls
+    """
+    with main.app.test_request_context('/boats/%d' % boat.key.id,
+                                       method='DELETE'):
+        metrics.start_request()
+        main.delete_boat(boat)
+        return {phase: calls for phase, (spent, calls)
+                in sorted(main.g.timings.items())}
+
+
+def main_bench():
+    counts = [int(c) for c in sys.argv[1:]] or [10, 100, 1000]
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+    client = main.client
+
+    print('%6s %14s %14s %14s %14s  %s' % (
+        'loads', 'per-load ms', 'per-load /s', 'batched ms', 'batched /s',
+        'batched datastore calls'))
+    for count in counts:
+        boat = make_boat(client, count)
+        start = time.perf_counter()
+        delete_boat_per_load(client, boat)
+        per_load = time.perf_counter() - start
+
+        boat = make_boat(client, count)
+        start = time.perf_counter()
+        calls = delete_boat_batched(boat)
+        batched = time.perf_counter() - start
+
+        print('%6d %14.1f %14.0f %14.1f %14.0f  %s' % (
+            count, per_load * 1000, count / per_load, batched * 1000,
+            count / batched,
+            ', '.join('%s %d' % item for item in calls.items())))
+
+
+if __name__ == '__main__':
+    main_bench()
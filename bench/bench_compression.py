@@ -0,0 +1,88 @@
+# Benchmark: bytes saved and CPU spent compressing typical boat responses
+# with gzip and brotli at several levels, whole and streamed
+#
+# Usage: python bench/bench_compression.py [iterations]
+
+import os
+import sys
+import time
+
+from google.cloud import datastore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import compression  # noqa: E402
+import const  # noqa: E402
+import representation  # noqa: E402
+
+BASE_URL = const.BASE_GAE_URL
+
+
+def make_boat(id, num_loads):
+    key = datastore.Key(const.BOATS, 1234567890 + id, project='bench')
+    boat = datastore.Entity(key=key)
+    boat.update({'name': 'Odyssey %d' % id, 'type': 'Barge', 'length': 99,
+                 'owner': 'auth0|bench',
+                 'loads': list(range(5000000000 + id * num_loads,
+                                     5000000000 + (id + 1) * num_loads))})
+    return boat
+
+
+def payloads():
+    """Return a list of (name, JSON bytes, streamed chunks) for the
+    responses to measure
+    """
+    cases = []
+    for num_loads in (10, 100, 1000):
+        body = representation.boat_json(make_boat(0, num_loads), BASE_URL)
+        cases.append(('boat, %d loads' % num_loads, body.encode('utf-8'),
+                      None))
+    boats = [make_boat(i, 20) for i in range(5)]
+    body = representation.page_json(
+        'boats', boats, lambda boat: representation.boat_json(boat, BASE_URL),
+        {'pagination': const.PAGE_CURSOR})
+    cases.append(('page of 5 boats', body.encode('utf-8'), None))
+    boats = [make_boat(i, 20) for i in range(500)]
+    chunks = [chunk.encode('utf-8') for chunk in representation.stream_array(
+        boats, lambda boat: representation.boat_json(boat, BASE_URL),
+        '{"boats":[', ']}')]
+    cases.append(('stream of 500 boats', b''.join(chunks), chunks))
+    return cases
+
+
+def measure(compressor, encoding, body, chunks, iterations):
+    """Compress body, or its chunks one at a time if streamed
+
+    Return a tuple of (compressed size, CPU ms per response)
+    """
+    start = time.process_time()
+    for _ in range(iterations):
+        if chunks is None:
+            size = len(compressor.compress(body, encoding))
+        else:
+            size = sum(len(c) for c in
+                       compressor.compress_stream(chunks, encoding))
+    return size, (time.process_time() - start) / iterations * 1000
+
+
+def main_bench():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    settings = [('gzip', level) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        settings += [('br', quality) for quality in (1, 4, 11)]
+
+    print('%-22s %-8s %10s %10s %8s %10s' % (
+        'payload', 'encoding', 'raw bytes', 'sent', 'saved %', 'CPU ms'))
+    for name, body, chunks in payloads():
+        for encoding, level in settings:
+            compressor = compression.Compressor(level=level,
+                                                brotli_quality=level)
+            size, cpu = measure(compressor, encoding, body, chunks,
+                                iterations)
+            print('%-22s %-8s %10d %10d %8.1f %10.3f' % (
+                name, '%s-%d' % (encoding, level), len(body), size,
+                (1 - size / len(body)) * 100, cpu))
+
+
+if __name__ == '__main__':
+    main_bench()
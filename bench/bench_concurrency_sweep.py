@@ -0,0 +1,131 @@
+# Benchmark: throughput ceiling of one instance across gunicorn worker and
+# thread counts
+#
+# Each configuration starts gunicorn with gunicorn.conf.py against the
+# Datastore emulator and tokens from bench/stub_auth0.py, then drives it
+# with enough client threads to keep every server thread busy.
+#
+# Usage:
+#   python bench/bench_concurrency_sweep.py [seconds] [workers,threads ...]
+#   python bench/bench_concurrency_sweep.py 10 1,1 1,8 2,8 4,8 4,16
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+import loadtest
+import stub_auth0
+
+DEFAULT_CONFIGS = ['1,1', '1,4', '1,8', '2,4', '2,8', '4,8', '4,16']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, threads, port, issuer_url):
+    """Start gunicorn with the given counts and wait until it answers
+
+    Return the process
+    """
+    server_env = dict(os.environ, PORT=str(port), AUTH0_JWKS_URL=issuer_url,
+                      GUNICORN_WORKERS=str(workers),
+                      GUNICORN_THREADS=str(threads))
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '--bind', '127.0.0.1:%d' % port, 'main:app'],
+        cwd=loadtest.ROOT_DIR, env=server_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get('http://127.0.0.1:%d/metrics' % port, timeout=1)
+            return proc
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit('gunicorn did not start on port %d' % port)
+
+
+def drive(app_url, token, seconds, clients):
+    """Send GET /boats/<id> and GET /boats from clients threads for seconds
+
+    Return a tuple of (requests per second, sorted latencies in ms, errors)
+    """
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json'}
+    boat = requests.post(app_url + '/boats', headers=headers,
+                         json={'name': 'sweep', 'type': 'Barge',
+                               'length': 10}).json()
+    urls = [app_url + '/boats/%s' % boat['id'], app_url + '/boats']
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def worker(n):
+        session = requests.Session()
+        mine = []
+        failed = 0
+        i = n
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            resp = session.get(urls[i % len(urls)], headers=headers)
+            mine.append((time.perf_counter() - start) * 1000)
+            if resp.status_code != 200:
+                failed += 1
+            i += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / seconds, sorted(latencies), errors[0]
+
+
+def main_bench():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    configs = sys.argv[2:] or DEFAULT_CONFIGS
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    issuer = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID'])
+    issuer_url = issuer.serve()
+    token = issuer.mint('auth0|sweep')
+
+    print('%8s %8s %8s %10s %10s %8s' % ('workers', 'threads', 'rps',
+                                         'p50 ms', 'p99 ms', 'errors'))
+    for config in configs:
+        workers, threads = (int(n) for n in config.split(','))
+        port = free_port()
+        proc = start_server(workers, threads, port, issuer_url)
+        try:
+            rps, latencies, errors = drive(
+                'http://127.0.0.1:%d' % port, token, seconds,
+                clients=workers * threads * 2)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print('%8d %8d %8.1f %10.2f %10.2f %8d' % (
+            workers, threads, rps, loadtest.percentile(latencies, 50),
+            loadtest.percentile(latencies, 99), errors))
+    issuer.shutdown()
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,85 @@
+# Benchmark: p50/p99 latency of boat routes with the request's lookups run
+# one after another (CONCURRENT_IO=0) vs. at the same time
+#
+# Requires the Datastore emulator (see bench_pagination.py). The entity and
+# token caches are disabled so every request pays for its I/O.
+#
+# Usage: python bench/bench_concurrent_io.py [requests] [clients]
+
+import os
+import sys
+import threading
+import time
+
+import requests
+
+import loadtest
+import stub_auth0
+
+
+def run(url, headers, count, clients):
+    """Send count GET requests from clients threads
+
+    Return the sorted latencies in ms
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        mine = []
+        for _ in range(count // clients):
+            start = time.perf_counter()
+            session.get(url, headers=headers)
+            mine.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies)
+
+
+def main_bench():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    issuer = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID'])
+    app_url, main = loadtest.start_app(issuer.serve())
+    main.entity_store.ttl = 0
+    main.token_store.max_size = 0
+
+    headers = {'Authorization': 'Bearer ' + issuer.mint('auth0|bench'),
+               'Accept': 'application/json'}
+    boat = requests.post(app_url + '/boats', headers=headers,
+                         json={'name': 'bench', 'type': 'Barge',
+                               'length': 10}).json()
+    load = requests.post(app_url + '/loads', headers=headers,
+                         json={'volume': 1, 'item': 'crate',
+                               'creation_date': '06/11/2023'}).json()
+    requests.put(app_url + '/boats/%s/loads/%s' % (boat['id'], load['id']),
+                 headers=headers)
+
+    url = app_url + '/boats/%s' % boat['id']
+    print('%-12s %10s %10s' % ('mode', 'p50 ms', 'p99 ms'))
+    for enabled in (False, True):
+        main.io_pool.enabled = enabled
+        run(url, headers, clients * 10, clients)
+        latencies = run(url, headers, count, clients)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print('%-12s %10.2f %10.2f' % ('concurrent' if enabled else 'sync',
+                                       p50, p99))
+    issuer.shutdown()
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,100 @@
+# Benchmark: throughput of error-heavy and entity-heavy responses with each
+# JSON encoder in fast_json.ENCODERS, and with the err_obj bodies encoded
+# once at startup vs. on every request
+#
+# Error responses run through main.app with Flask's test client and need no
+# emulator or Auth0. Entity pages are encoded from synthetic entities with
+# representation.page_json, as the collection routes do.
+#
+# Usage: python bench/bench_json.py [requests] [page_size]
+
+import os
+import sys
+import time
+
+from google.cloud import datastore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import const  # noqa: E402
+import fast_json  # noqa: E402
+import representation  # noqa: E402
+
+BASE_URL = const.BASE_GAE_URL
+
+# One request of each error the app answers before touching datastore
+ERROR_MIX = [
+    ('GET', '/boats', {'Accept': 'text/html'}),
+    ('DELETE', '/boats', {'Accept': 'application/json'}),
+    ('GET', '/boats', {'Accept': 'application/json'}),
+    ('GET', '/boats', {'Accept': 'application/json',
+                       'Authorization': 'Basic bench'}),
+]
+
+
+def make_loads(count):
+    """Return count load entities like the ones stored in datastore"""
+    loads = []
+    for n in range(count):
+        load = datastore.Entity(
+            key=datastore.Key(const.LOADS, 5000000000 + n, project='bench'))
+        load.update({'volume': n, 'item': 'crate of lemons %d' % n,
+                     'creation_date': '06/11/2023', 'carrier': None})
+        loads.append(load)
+    return loads
+
+
+def error_rps(app, count):
+    """Send the error mix count times round
+
+    Return requests per second
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        for method, url, headers in ERROR_MIX:
+            app.open(url, method=method, headers=headers)
+    return count * len(ERROR_MIX) / (time.perf_counter() - start)
+
+
+def page_rps(loads, count):
+    """Encode a page of loads count times
+
+    Return pages per second
+    """
+    extra = {'pagination': 'cursor', 'next': BASE_URL + '/loads?cursor=x'}
+
+    def encode(load):
+        return representation.load_json(load, BASE_URL)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        representation.page_json('loads', loads, encode, extra)
+    return count / (time.perf_counter() - start)
+
+
+def main_bench():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    import main
+    app = main.app.test_client()
+    error_bodies = dict(main.ERROR_BODIES)
+    loads = make_loads(page_size)
+
+    print('%-10s %22s %22s %16s' % ('encoder', 'errors/s (pre-encoded)',
+                                    'errors/s (per request)', 'pages/s'))
+    for name in fast_json.ENCODERS:
+        fast_json.use(name)
+        main.ERROR_BODIES.update(error_bodies)
+        pre_encoded = error_rps(app, count)
+        main.ERROR_BODIES.clear()
+        per_request = error_rps(app, count)
+        pages = page_rps(loads, max(1, count // 10))
+        print('%-10s %22.0f %22.0f %16.1f' % (name, pre_encoded, per_request,
+                                              pages))
+    main.ERROR_BODIES.update(error_bodies)
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,82 @@
+# Benchmark: page-N latency of offset vs. cursor pagination on the loads kind
+#
+# Requires the Datastore emulator:
+#   gcloud beta emulators datastore start --no-store-on-disk
+#   $(gcloud beta emulators datastore env-init)
+#
+# Usage: python bench/bench_pagination.py [num_loads] [page_size]
+
+import os
+import sys
+import time
+
+from google.cloud import datastore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import const  # noqa: E402
+
+BATCH = 500
+
+
+def seed(client, count):
+    """Create count loads if the kind holds fewer than that"""
+    existing = len(list(client.query(kind=const.LOADS).keys_only().fetch(
+        limit=count)))
+    for start in range(existing, count, BATCH):
+        entities = []
+        for i in range(start, min(start + BATCH, count)):
+            entity = datastore.Entity(key=client.key(const.LOADS))
+            entity.update({'volume': i % 100, 'item': 'bench item %d' % i,
+                           'creation_date': '06/11/2023', 'carrier': None})
+            entities.append(entity)
+        client.put_multi(entities)
+
+
+def time_offset_page(client, page, page_size):
+    query = client.query(kind=const.LOADS)
+    start = time.perf_counter()
+    g_iterator = query.fetch(limit=page_size, offset=page * page_size)
+    list(next(g_iterator.pages))
+    return time.perf_counter() - start
+
+
+def walk_cursor_pages(client, pages, page_size):
+    """Follow cursors through pages and return the latency of each page"""
+    latencies = []
+    cursor = None
+    for _ in range(pages):
+        query = client.query(kind=const.LOADS)
+        start = time.perf_counter()
+        g_iterator = query.fetch(limit=page_size, start_cursor=cursor)
+        list(next(g_iterator.pages))
+        latencies.append(time.perf_counter() - start)
+        cursor = g_iterator.next_page_token
+        if not cursor:
+            break
+    return latencies
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+
+    client = datastore.Client()
+    seed(client, count)
+
+    total_pages = count // page_size
+    sample = [0, 10, 100, 1000, total_pages // 2, total_pages - 1]
+    sample = sorted(set(p for p in sample if p < total_pages))
+    cursor_latencies = walk_cursor_pages(client, sample[-1] + 1, page_size)
+
+    print('%10s %14s %14s' % ('page', 'offset (ms)', 'cursor (ms)'))
+    for page in sample:
+        offset_ms = time_offset_page(client, page, page_size) * 1000
+        cursor_ms = cursor_latencies[page] * 1000
+        print('%10d %14.2f %14.2f' % (page, offset_ms, cursor_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Benchmark: response-build time for a boat carrying many loads, expanding
+# load dicts and calling jsonify vs. representation.boat_json
+#
+# Usage: python bench/bench_representation.py [num_loads] [iterations]
+
+import os
+import sys
+import timeit
+
+from flask import Flask, jsonify
+from google.cloud import datastore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import const  # noqa: E402
+import representation  # noqa: E402
+
+BASE_URL = const.BASE_GAE_URL
+
+
+def make_boat(num_loads):
+    key = datastore.Key(const.BOATS, 1234567890, project='bench')
+    boat = datastore.Entity(key=key)
+    boat.update({'name': 'Odyssey', 'type': 'Barge', 'length': 99,
+                 'owner': 'auth0|bench',
+                 'loads': list(range(5000000000, 5000000000 + num_loads))})
+    return boat
+
+
+def build_expanded(boat):
+    """The response build as it was: copy, expand loads to dicts, jsonify"""
+    stored = boat
+    boat = datastore.Entity(key=stored.key)
+    boat.update(stored)
+    boat['loads'] = [{'id': int(id), 'self': BASE_URL + '/loads/' + str(id)}
+                     for id in boat['loads']]
+    boat['id'] = boat.key.id
+    boat['self'] = BASE_URL + '/boats/' + str(boat.key.id)
+    return jsonify(boat).get_data()
+
+
+def main():
+    num_loads = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    boat = make_boat(num_loads)
+
+    app = Flask(__name__)
+    with app.app_context():
+        expanded = timeit.timeit(lambda: build_expanded(boat),
+                                 number=iterations)
+    direct = timeit.timeit(lambda: representation.boat_json(boat, BASE_URL),
+                           number=iterations)
+
+    print('loads per boat:      %d' % num_loads)
+    print('expand + jsonify:    %.3f ms' % (expanded / iterations * 1000))
+    print('boat_json:           %.3f ms' % (direct / iterations * 1000))
+    print('speedup:             %.1fx' % (expanded / direct))
+
+
+if __name__ == '__main__':
+    main()
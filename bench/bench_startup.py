@@ -0,0 +1,91 @@
+# Benchmark: cold start time, from importing main to its first responses
+#
+# Each run is a fresh interpreter that imports main, then serves GET / and,
+# when the Datastore emulator is up, GET /loads, the first response that
+# needs the datastore client. Results can be saved and compared with a
+# baseline, like bench/loadtest.py, so cold start regressions fail the run.
+#
+# Usage: python bench/bench_startup.py [--runs 5] [--out FILE]
+#                                      [--baseline FILE] [--threshold 20]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import loadtest
+
+# Run in the child interpreter. Prints the phase times in ms as JSON
+PROBE = '''
+import json, os, time
+start = time.perf_counter()
+import main
+times = {'import_ms': (time.perf_counter() - start) * 1000}
+app = main.app.test_client()
+app.get('/')
+times['first_response_ms'] = (time.perf_counter() - start) * 1000
+if os.environ.get('DATASTORE_EMULATOR_HOST'):
+    app.get('/loads?limit=1', headers={'Accept': 'application/json'})
+    times['first_datastore_response_ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(times))
+'''
+
+
+def measure(runs):
+    """Run the probe runs times
+
+    Return a dictionary of phase name to the median time in ms
+    """
+    samples = {}
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE],
+                             cwd=loadtest.ROOT_DIR, check=True,
+                             capture_output=True, text=True).stdout
+        for phase, ms in json.loads(out.strip().splitlines()[-1]).items():
+            samples.setdefault(phase, []).append(ms)
+    return {phase: loadtest.percentile(values, 50)
+            for phase, values in samples.items()}
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(
+        description='Measure import-to-first-response time of main')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='percent increase counted as a regression')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    results = measure(args.runs)
+    for phase, ms in sorted(results.items()):
+        print('%-30s %10.1f ms' % (phase, ms))
+
+    if args.out:
+        out_dir = os.path.dirname(args.out)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = 0
+        for phase, ms in sorted(results.items()):
+            old = baseline.get(phase)
+            if not old:
+                continue
+            change = (ms - old) / old * 100
+            flag = '  REGRESSION' if change > args.threshold else ''
+            regressions += bool(flag)
+            print('%-30s %+10.1f %%%s' % (phase, change, flag))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_bench()
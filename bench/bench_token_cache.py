@@ -0,0 +1,64 @@
+# Microbenchmark: cold RS256 verification vs. verified-token cache hits
+#
+# Usage: python bench/bench_token_cache.py [iterations]
+
+import os
+import sys
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import token_cache  # noqa: E402
+
+AUDIENCE = 'bench-client'
+ISSUER = 'https://bench.local/'
+
+
+def make_keys():
+    """Generate an RSA key pair and return (private PEM, public PEM)"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption())
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_pem, public_pem
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    private_pem, public_pem = make_keys()
+    token = jwt.encode(
+        {'sub': 'auth0|bench', 'aud': AUDIENCE, 'iss': ISSUER,
+         'exp': int(time.time()) + 3600},
+        private_pem, algorithm='RS256')
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        jwt.decode(token, public_pem, algorithms=['RS256'],
+                   audience=AUDIENCE, issuer=ISSUER)
+    cold = time.perf_counter() - start
+
+    cache = token_cache.TokenCache()
+    cache.put(token, jwt.decode(token, public_pem, algorithms=['RS256'],
+                                audience=AUDIENCE, issuer=ISSUER))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        cache.get(token)
+    warm = time.perf_counter() - start
+
+    print('iterations:      %d' % iterations)
+    print('cold verify/s:   %.0f' % (iterations / cold))
+    print('warm lookup/s:   %.0f' % (iterations / warm))
+    print('speedup:         %.1fx' % (cold / warm))
+    print('hit rate:        %.3f' % cache.hit_rate())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Stress test: many threads loading, unloading and renaming one boat at
+# once, with and without transaction retries
+#
+# Requires the Datastore emulator (see bench_pagination.py). Each thread
+# owns its own loads and cycles them on and off the shared boat, so every
+# transaction touches the same boat entity in array mode.
+#
+# Usage: python bench/bench_txn_contention.py [threads] [cycles]
+
+import os
+import sys
+import threading
+import time
+
+import requests
+
+import loadtest
+import stub_auth0
+
+
+def stress(app_url, headers, boat_id, threads, cycles):
+    """Run threads workers that each put a load on the boat, take it off
+    and rename the boat, cycles times
+
+    Return a tuple of (status code counts, seconds taken)
+    """
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(n):
+        session = requests.Session()
+        load = session.post(app_url + '/loads', headers=headers,
+                            json={'volume': n, 'item': 'stress %d' % n,
+                                  'creation_date': '06/11/2023'}).json()
+        url = app_url + '/boats/%s/loads/%s' % (boat_id, load['id'])
+        mine = {}
+        for i in range(cycles):
+            for resp in (session.put(url, headers=headers),
+                         session.delete(url, headers=headers),
+                         session.patch(
+                             app_url + '/boats/%s' % boat_id,
+                             headers=headers,
+                             json={'name': 'stress %d %d' % (n, i)})):
+                mine[resp.status_code] = mine.get(resp.status_code, 0) + 1
+        with lock:
+            for status, count in mine.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    workers = [threading.Thread(target=worker, args=(n,))
+               for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return statuses, time.perf_counter() - start
+
+
+def main_bench():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    issuer = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID'])
+    app_url, main = loadtest.start_app(issuer.serve())
+    headers = {'Authorization': 'Bearer ' + issuer.mint('auth0|stress'),
+               'Accept': 'application/json'}
+    default_attempts = main.TXN_MAX_ATTEMPTS
+
+    print('%-10s %8s %10s %8s  %s' % ('attempts', 'requests', 'success %',
+                                      'rps', 'statuses'))
+    for attempts in (1, default_attempts):
+        main.TXN_MAX_ATTEMPTS = attempts
+        boat = requests.post(app_url + '/boats', headers=headers,
+                             json={'name': 'stress', 'type': 'Barge',
+                                   'length': 10}).json()
+        statuses, seconds = stress(app_url, headers, boat['id'], threads,
+                                   cycles)
+        total = sum(statuses.values())
+        ok = sum(count for status, count in statuses.items()
+                 if status < 300)
+        print('%-10d %8d %10.1f %8.1f  %s' % (
+            attempts, total, ok * 100.0 / total, total / seconds,
+            dict(sorted(statuses.items()))))
+
+    print()
+    metrics_text = requests.get(app_url + '/metrics',
+                                headers=loadtest.METRICS_HEADERS).text
+    for line in metrics_text.splitlines():
+        if line.startswith('app_transaction_events_total{'):
+            print(line)
+    issuer.shutdown()
+
+
+if __name__ == '__main__':
+    main_bench()
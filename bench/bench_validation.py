@@ -0,0 +1,78 @@
+# Benchmark: latency of requests rejected for a bad body, which are now
+# answered before the JWT is verified or datastore is read
+#
+# Runs main.app through Flask's test client with tokens from
+# bench/stub_auth0.py, so no emulator is needed. The token cache is turned
+# off so the bad-token row shows what a full RS256 check costs.
+#
+# Usage: python bench/bench_validation.py [requests]
+
+import json
+import os
+import sys
+import time
+
+import loadtest
+import stub_auth0
+
+
+def time_requests(app, count, method, url, headers, body):
+    """Send the same request count times
+
+    Return a tuple of (status code of the last response, sorted ms)
+    """
+    latencies = []
+    status = None
+    for _ in range(count):
+        start = time.perf_counter()
+        resp = app.open(url, method=method, headers=headers, data=body)
+        latencies.append((time.perf_counter() - start) * 1000)
+        status = resp.status_code
+    return status, sorted(latencies)
+
+
+def main_bench():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    issuer = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID'])
+    issuer_url = issuer.serve()
+    import main
+    main.jwks_store.url = issuer_url
+    main.jwks_store.invalidate()
+    main.token_store.max_size = 0
+    app = main.app.test_client()
+
+    token = issuer.mint('auth0|bench')
+    forged = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID']).mint(
+                                       'auth0|bench')
+    headers = {'Accept': 'application/json',
+               'Content-Type': 'application/json'}
+    good = json.dumps({'name': 'Sea Witch', 'type': 'Catamaran',
+                       'length': 28})
+    cases = [
+        ('missing attribute', token,
+         json.dumps({'name': 'Sea Witch', 'type': 'Catamaran'})),
+        ('wrong type', token,
+         json.dumps({'name': 'Sea Witch', 'type': 'Catamaran',
+                     'length': '28'})),
+        ('not JSON', token, '{"name": '),
+        ('bad token, good body', forged, good),
+    ]
+
+    print('%-22s %7s %10s %10s' % ('POST /boats', 'status', 'p50 ms',
+                                   'p99 ms'))
+    for name, bearer, body in cases:
+        status, latencies = time_requests(
+            app, count, 'POST', '/boats',
+            dict(headers, Authorization='Bearer ' + bearer), body)
+        print('%-22s %7d %10.3f %10.3f' % (
+            name, status, loadtest.percentile(latencies, 50),
+            loadtest.percentile(latencies, 99)))
+    issuer.shutdown()
+
+
+if __name__ == '__main__':
+    main_bench()
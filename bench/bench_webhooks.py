@@ -0,0 +1,106 @@
+# Benchmark: batched webhook delivery of change records to a local HTTP
+# sink that fails some of its requests, checking that every record arrives
+# once, in order, with a valid signature
+#
+# Needs no emulator: records are queued on a webhooks.WebhookSender the way
+# main.publish_changes queues them.
+#
+# Usage: python bench/bench_webhooks.py [records] [failure_rate]
+
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import webhooks  # noqa: E402
+
+SECRET = 'bench-secret'
+
+
+class Sink():
+    def __init__(self, failure_rate):
+        """Initializes a webhook receiver that answers failure_rate of its
+        requests with a 503 and records the batches it accepts
+        """
+        self.failure_rate = failure_rate
+        self.batches = []
+        self.rejected = 0
+        self.bad_signatures = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve(self):
+        """Serve on a free local port in a background thread
+
+        Return the URL to deliver to
+        """
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                expected = 'sha256=' + hmac.new(
+                    SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+                with sink._lock:
+                    if self.headers.get('X-Webhook-Signature') != expected:
+                        sink.bad_signatures += 1
+                    if random.random() < sink.failure_rate:
+                        sink.rejected += 1
+                        status = 503
+                    else:
+                        sink.batches.append(json.loads(body)['changes'])
+                        status = 204
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return 'http://127.0.0.1:%d/hook' % self._server.server_port
+
+    def shutdown(self):
+        self._server.shutdown()
+
+
+def main_bench():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+
+    sink = Sink(failure_rate)
+    sender = webhooks.WebhookSender(sink.serve(), secret=SECRET,
+                                    batch_size=100, interval=0.05,
+                                    max_attempts=8, backoff_base=0.01,
+                                    backoff_max=0.2)
+    start = time.perf_counter()
+    for seq in range(1, count + 1):
+        sender.enqueue([{'seq': str(seq), 'op': 'update', 'kind': 'boats',
+                         'id': seq % 50}])
+    sender.flush()
+    seconds = time.perf_counter() - start
+    sink.shutdown()
+
+    received = [int(r['seq']) for batch in sink.batches for r in batch]
+    print('records queued:       %d' % count)
+    print('records received:     %d' % len(received))
+    print('duplicates:           %d' % (len(received) - len(set(received))))
+    print('in order:             %s' % (received == sorted(received)))
+    print('batches accepted:     %d' % len(sink.batches))
+    print('batches rejected:     %d' % sink.rejected)
+    print('bad signatures:       %d' % sink.bad_signatures)
+    print('sender counters:      %s' % sender.stats())
+    print('records per second:   %.0f' % (count / seconds))
+
+
+if __name__ == '__main__':
+    main_bench()
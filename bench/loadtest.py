@@ -0,0 +1,291 @@
+# Load test that replays the Postman collection against a local instance
+#
+# The app runs in-process against the Datastore emulator, with tokens
+# minted by bench/stub_auth0.py. Each worker thread replays the whole
+# collection in order with its own variables, so the scenarios that
+# create, update and delete entities stay consistent under concurrency.
+#
+# Usage:
+#   $(gcloud beta emulators datastore env-init)
+#   python bench/loadtest.py --concurrency 8 --iterations 5 \
+#       --out bench/results/this_commit.json \
+#       --baseline bench/results/last_commit.json
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import requests
+
+from werkzeug.serving import make_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+COLLECTION = os.path.join(ROOT_DIR, 'lubranoa_project.postman_collection.json')
+
+VAR_RE = re.compile(r'{{(\w+)}}')
+SET_RE = re.compile(r'pm\.environment\.set\("(\w+)",\s*'
+                    r'pm\.response\.json\(\)\["(\w+)"\]\)')
+STATUS_RE = re.compile(r'pm\.response\.to\.have\.status\((\d+)\)')
+
+# Sent by benchmarks that read /metrics from an app started by start_app
+METRICS_HEADERS = {'Authorization': 'Bearer bench-metrics'}
+
+
+def load_scenarios(path):
+    """Read every request of a Postman collection into a list of scenario
+    dictionaries with the method, url, headers, body, bearer token, the
+    expected status, and the variables its test script captures
+    """
+    with open(path) as f:
+        collection = json.load(f)
+    scenarios = []
+    for item in collection['item']:
+        req = item['request']
+        script = []
+        for event in item.get('event', []):
+            if event.get('listen') == 'test':
+                script.extend(event['script'].get('exec', []))
+        script = '\n'.join(script)
+        status = STATUS_RE.search(script)
+
+        token = None
+        auth = req.get('auth') or {}
+        if auth.get('type') == 'bearer':
+            token = auth['bearer'][0]['value']
+
+        headers = {h['key']: h['value'] for h in req.get('header', [])
+                   if not h.get('disabled')}
+        headers.pop('Content-Length', None)
+        body = req.get('body', {}).get('raw') or None
+        if body is not None:
+            headers.setdefault('Content-Type', 'application/json')
+        headers.setdefault('Accept', '*/*')
+
+        url = req['url']['raw']
+        scenarios.append({
+            'name': item['name'],
+            'method': req['method'],
+            'url': url,
+            'endpoint': req['method'] + ' ' + VAR_RE.sub(
+                lambda m: ':' + m.group(1), url.replace('{{app_url}}', '')),
+            'headers': headers,
+            'body': body,
+            'token': token,
+            'status': int(status.group(1)) if status else None,
+            'captures': SET_RE.findall(script)
+        })
+    return scenarios
+
+
+def fill(text, env):
+    return VAR_RE.sub(lambda m: str(env.get(m.group(1), m.group(0))), text)
+
+
+def replay(session, scenarios, env, samples, errors):
+    """Run every scenario once in order, appending (endpoint, seconds) to
+    samples and (name, expected, actual) to errors
+    """
+    for scenario in scenarios:
+        url = fill(scenario['url'], env)
+        if '{{' in url:
+            # A variable it depends on was never captured
+            errors.append((scenario['name'], scenario['status'], None))
+            continue
+        headers = {k: fill(v, env) for k, v in scenario['headers'].items()}
+        if scenario['token'] is not None:
+            headers['Authorization'] = 'Bearer ' + fill(scenario['token'],
+                                                        env)
+        body = scenario['body']
+        if body is not None:
+            body = fill(body, env).encode('utf-8')
+
+        start = time.perf_counter()
+        resp = session.request(scenario['method'], url, headers=headers,
+                               data=body)
+        samples.append((scenario['endpoint'], time.perf_counter() - start))
+
+        if scenario['status'] is not None and \
+                resp.status_code != scenario['status']:
+            errors.append((scenario['name'], scenario['status'],
+                           resp.status_code))
+        for var, attr in scenario['captures']:
+            try:
+                env[var] = resp.json()[attr]
+            except (ValueError, KeyError, TypeError):
+                pass
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples, wall):
+    """Return per-endpoint throughput and latency percentiles in ms"""
+    by_endpoint = {}
+    for endpoint, seconds in samples:
+        by_endpoint.setdefault(endpoint, []).append(seconds * 1000)
+    summary = {}
+    for endpoint, values in sorted(by_endpoint.items()):
+        summary[endpoint] = {
+            'count': len(values),
+            'rps': len(values) / wall,
+            'p50_ms': percentile(values, 50),
+            'p90_ms': percentile(values, 90),
+            'p99_ms': percentile(values, 99),
+            'max_ms': max(values)
+        }
+    return summary
+
+
+def compare(current, baseline, threshold):
+    """Print the change of each endpoint's p50, p99 and throughput against a
+    baseline. Return the number of regressions beyond threshold percent
+    """
+    regressions = 0
+    print('\n%-45s %10s %10s %10s' % ('endpoint', 'p50 %', 'p99 %', 'rps %'))
+    for endpoint, now in current['endpoints'].items():
+        before = baseline['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        deltas = []
+        for metric in ('p50_ms', 'p99_ms', 'rps'):
+            old = before[metric] or 1e-9
+            deltas.append((now[metric] - old) / old * 100)
+        flag = ''
+        if deltas[0] > threshold or deltas[1] > threshold or \
+                deltas[2] < -threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-45s %+10.1f %+10.1f %+10.1f%s' % (
+            endpoint[:45], deltas[0], deltas[1], deltas[2], flag))
+    return regressions
+
+
+def start_app(issuer_url):
+    """Serve main.app on a free local port in a background thread
+
+    Return the base URL of the server and the imported main module
+    """
+    import main
+
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    base_url = 'http://127.0.0.1:%d' % server.server_port
+    main.BASE_URL = base_url
+    main.jwks_store.url = issuer_url
+    main.jwks_store.invalidate()
+    main.METRICS_TOKEN = 'bench-metrics'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return base_url, main
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(
+        description='Replay the Postman collection as a load test')
+    parser.add_argument('--collection', default=COLLECTION)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='collection replays per worker')
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change counted as a regression')
+    args = parser.parse_args()
+
+    if 'DATASTORE_EMULATOR_HOST' not in os.environ:
+        sys.exit('DATASTORE_EMULATOR_HOST is not set')
+
+    import stub_auth0
+    os.environ.setdefault('AUTH0_DOMAIN', 'bench.local')
+    os.environ.setdefault('AUTH0_CLIENT_ID', 'bench-client')
+    issuer = stub_auth0.StubIssuer(os.environ['AUTH0_DOMAIN'],
+                                   os.environ['AUTH0_CLIENT_ID'])
+    issuer_url = issuer.serve()
+    app_url, app_main = start_app(issuer_url)
+
+    scenarios = load_scenarios(args.collection)
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        env = {
+            'app_url': app_url,
+            'jwt1': issuer.mint('auth0|bench-%d-a' % n),
+            'jwt2': issuer.mint('auth0|bench-%d-b' % n),
+            'invalid_jwt': 'not.a.jwt',
+            'invalid_boat_id': '1',
+            'invalid_load_id': '1'
+        }
+        session = requests.Session()
+        my_samples = []
+        my_errors = []
+        for _ in range(args.iterations):
+            replay(session, scenarios, dict(env), my_samples, my_errors)
+        with lock:
+            samples.extend(my_samples)
+            errors.extend(my_errors)
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    results = {
+        'concurrency': args.concurrency,
+        'iterations': args.iterations,
+        'requests': len(samples),
+        'wall_s': wall,
+        'rps': len(samples) / wall,
+        'status_mismatches': len(errors),
+        'endpoints': summarize(samples, wall),
+        'caches': {
+            'jwks': app_main.jwks_store.stats(),
+            'token': app_main.token_store.stats(),
+            'entity': app_main.entity_store.stats()
+        }
+    }
+
+    print('%-45s %7s %8s %8s %8s %8s' % ('endpoint', 'count', 'rps',
+                                         'p50 ms', 'p90 ms', 'p99 ms'))
+    for endpoint, row in results['endpoints'].items():
+        print('%-45s %7d %8.1f %8.2f %8.2f %8.2f' % (
+            endpoint[:45], row['count'], row['rps'], row['p50_ms'],
+            row['p90_ms'], row['p99_ms']))
+    print('\ntotal: %d requests in %.1fs (%.1f rps), %d status mismatches'
+          % (len(samples), wall, results['rps'], len(errors)))
+    for name, expected, actual in sorted(set(errors))[:20]:
+        print('  %s: expected %s, got %s' % (name, expected, actual))
+
+    if args.out:
+        out_dir = os.path.dirname(args.out)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    issuer.shutdown()
+
+
+if __name__ == '__main__':
+    main_bench()
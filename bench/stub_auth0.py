@@ -0,0 +1,84 @@
+# A stand-in for Auth0 that mints RS256 access tokens and serves its JWKS
+# over local HTTP, for benchmarks that should not depend on the real tenant
+
+import base64
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+
+def _b64_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+class StubIssuer():
+    def __init__(self, domain, audience, kid='bench-key'):
+        """Initializes an issuer that signs tokens the way the Auth0 tenant
+        at domain would for the given audience, with a fresh RSA key
+        """
+        self.domain = domain
+        self.audience = audience
+        self.kid = kid
+        self.url = None
+        self._server = None
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._private_pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+        numbers = key.public_key().public_numbers()
+        self.jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': _b64_uint(numbers.n),
+            'e': _b64_uint(numbers.e)
+        }]}
+
+    def mint(self, sub, ttl=3600):
+        """Return a signed access token for the subject sub"""
+        now = int(time.time())
+        claims = {'sub': sub, 'aud': self.audience,
+                  'iss': 'https://' + self.domain + '/',
+                  'iat': now, 'exp': now + ttl}
+        return jwt.encode(claims, self._private_pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+    def serve(self, host='127.0.0.1', port=0):
+        """Serve the JWKS on a background thread
+
+        Return the URL of the key set
+        """
+        body = json.dumps(self.jwks).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        self.url = 'http://%s:%d/.well-known/jwks.json' % (
+            host, self._server.server_address[1])
+        return self.url
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
@@ -0,0 +1,166 @@
+# An ordered log of the changes made to boats and loads, read through the
+# /changes feed with sequence cursors
+
+import bisect
+import datetime
+import random
+import threading
+import time
+
+from google.cloud import datastore
+
+import const
+
+
+def public(record):
+    """Return a copy of record to send to clients, with its 'seq' as a
+    string, since JavaScript numbers can't hold every seq exactly
+    """
+    return dict(record, seq=str(record['seq']))
+
+
+class LogBackend():
+    """Interface for the storage behind a ChangeLog"""
+
+    def append(self, records):
+        """Store records, each a dictionary with a unique 'seq'"""
+        raise NotImplementedError
+
+    def read(self, after, until, limit):
+        """Return at most limit records with after < seq <= until, in seq
+        order
+        """
+        raise NotImplementedError
+
+
+class MemoryLogBackend(LogBackend):
+    def __init__(self, max_records=100000):
+        """Initializes an in-process log that keeps the newest max_records
+        records. Only requests served by this process see its records, so
+        it suits a single process, such as the development server
+        """
+        self.max_records = max_records
+        self._seqs = []
+        self._records = []
+        self._lock = threading.Lock()
+
+    def append(self, records):
+        with self._lock:
+            for record in records:
+                # Records from concurrent requests may arrive out of order
+                i = bisect.bisect(self._seqs, record['seq'])
+                self._seqs.insert(i, record['seq'])
+                self._records.insert(i, record)
+            extra = len(self._seqs) - self.max_records
+            if extra > 0:
+                del self._seqs[:extra]
+                del self._records[:extra]
+
+    def read(self, after, until, limit):
+        with self._lock:
+            start = bisect.bisect_right(self._seqs, after)
+            end = min(bisect.bisect_right(self._seqs, until), start + limit)
+            return self._records[start:end]
+
+
+class DatastoreLogBackend(LogBackend):
+    def __init__(self, client, kind=const.CHANGES, retention=7 * 86400):
+        """Initializes a log stored as datastore entities of kind, keyed by
+        their seq, which every process and instance shares. Each record
+        gets an 'expire_at' time retention seconds away, for a datastore
+        TTL policy to delete it by
+        """
+        self.client = client
+        self.kind = kind
+        self.retention = retention
+
+    def append(self, records):
+        expire_at = (datetime.datetime.now(datetime.timezone.utc)
+                     + datetime.timedelta(seconds=self.retention))
+        entities = []
+        for record in records:
+            entity = datastore.Entity(
+                key=self.client.key(self.kind, record['seq']),
+                exclude_from_indexes=[k for k in record if k != 'seq'])
+            entity.update(record)
+            entity['expire_at'] = expire_at
+            entities.append(entity)
+        for i in range(0, len(entities), const.MAX_COMMIT_ENTITIES):
+            self.client.put_multi(entities[i:i + const.MAX_COMMIT_ENTITIES])
+
+    def read(self, after, until, limit):
+        query = self.client.query(kind=self.kind)
+        query.add_filter('seq', '>', after)
+        query.add_filter('seq', '<=', until)
+        query.order = ['seq']
+        found = []
+        for entity in query.fetch(limit=limit):
+            record = dict(entity)
+            record.pop('expire_at', None)
+            found.append(record)
+        return found
+
+
+class ChangeLog():
+    def __init__(self, backend=None, settle=2.0):
+        """Initializes a change log stored in backend.
+
+        A record's seq is the microsecond it was appended at, followed by
+        three random digits so records from different processes don't
+        collide. Clocks differ a little between instances and a record is
+        stored a moment after its seq is taken, so readers only see records
+        older than settle seconds. Otherwise a reader could move its cursor
+        past a record that had not been stored yet
+        """
+        self.backend = backend if backend is not None else MemoryLogBackend()
+        self.settle = settle
+        self.appended = 0
+        self.failed = 0
+        self._last_seq = 0
+        self._lock = threading.Lock()
+
+    def _next_seq(self):
+        seq = time.time_ns() // 1000 * 1000 + random.randrange(1000)
+        with self._lock:
+            # Keep this process's records in order if the clock steps back
+            seq = max(seq, self._last_seq + 1)
+            self._last_seq = seq
+        return seq
+
+    def append(self, records):
+        """Give each record a 'seq' and a 'time' and store them. A write
+        that already committed must not fail because its records could not
+        be stored, so errors are counted instead of raised
+
+        Return True if the records were stored
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for record in records:
+            record['seq'] = self._next_seq()
+            record['time'] = now.isoformat()
+        try:
+            self.backend.append(records)
+        except Exception:
+            self.failed += len(records)
+            return False
+        self.appended += len(records)
+        return True
+
+    def head(self):
+        """Return the cursor of the newest settled position in the log.
+        Reading from it skips every record that has settled so far
+        """
+        return (time.time_ns() // 1000 - int(self.settle * 1000000)) * 1000
+
+    def read(self, after, limit):
+        """Return at most limit records with a seq above after that have
+        settled, in seq order
+        """
+        until = self.head()
+        if until <= after:
+            return []
+        return self.backend.read(after, until, limit)
+
+    def stats(self):
+        """Return a dictionary of record counters"""
+        return {'appended': self.appended, 'failed': self.failed}
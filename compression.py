@@ -0,0 +1,120 @@
+# Compresses response bodies with gzip or brotli, as negotiated from the
+# request's Accept-Encoding header
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import const
+
+# Mimetypes worth compressing
+COMPRESSIBLE = (const.APP_JSON, const.TEXT_PLAIN, const.EVENT_STREAM)
+
+# Added to the ETag of a compressed response, since its bytes differ from
+# the uncompressed one's
+ETAG_SUFFIXES = {'gzip': '-gzip', 'br': '-br'}
+
+
+def matching_etag(etag, etags):
+    """Look for etag, or etag with any encoding's suffix, in etags, a
+    request's If-Match or If-None-Match header
+
+    Return the form of etag found, or None
+    """
+    for tag in [etag] + [etag + s for s in ETAG_SUFFIXES.values()]:
+        if tag in etags:
+            return tag
+    return None
+
+
+class Compressor():
+    def __init__(self, min_size=1024, level=6, brotli_quality=4):
+        """Initializes a compressor for responses of at least min_size
+        bytes, using gzip at level (1-9) or brotli at brotli_quality (0-11)
+        when the brotli package is installed. Streamed responses are
+        always compressed, since their size isn't known up front
+        """
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        # In order of preference when a client accepts both equally
+        self.encodings = ['gzip']
+        if brotli is not None:
+            self.encodings.insert(0, 'br')
+
+    def negotiate(self, accept_encodings):
+        """Pick an encoding from a request's parsed Accept-Encoding header
+
+        Return 'br', 'gzip' or None
+        """
+        best = None
+        best_quality = 0
+        for name in self.encodings:
+            quality = accept_encodings.quality(name)
+            if quality > best_quality:
+                best, best_quality = name, quality
+        return best
+
+    def _compressobj(self, encoding):
+        if encoding == 'br':
+            return brotli.Compressor(quality=self.brotli_quality)
+        # wbits of 31 writes a gzip header and trailer
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def compress(self, data, encoding):
+        """Return data compressed whole with encoding"""
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        obj = self._compressobj(encoding)
+        return obj.compress(data) + obj.flush()
+
+    def compress_stream(self, chunks, encoding):
+        """Compress an iterable of byte chunks as it is read. Each chunk is
+        flushed, so a client sees every chunk, such as a Server-Sent
+        Event, as soon as it is sent
+
+        Yield the compressed chunks
+        """
+        obj = self._compressobj(encoding)
+        for chunk in chunks:
+            if encoding == 'br':
+                data = obj.process(chunk) + obj.flush()
+            else:
+                data = obj.compress(chunk) + obj.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield obj.finish() if encoding == 'br' else obj.flush()
+
+    def apply(self, response, accept_encodings):
+        """Compress a response in place if it is large enough and of a
+        compressible type, and the client accepts an encoding we offer
+
+        Return the response
+        """
+        if response.status_code < 200 or \
+                response.status_code in (204, 304) or \
+                'Content-Encoding' in response.headers or \
+                response.mimetype not in COMPRESSIBLE:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(
+                response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag + ETAG_SUFFIXES[encoding], weak)
+        return response
@@ -0,0 +1,51 @@
+# Runs independent blocking I/O calls of one request at the same time
+
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IOPool():
+    def __init__(self, max_workers=16, enabled=True):
+        """Initializes a shared thread pool for a request's independent
+        lookups, such as JWT verification and datastore gets.
+
+        When enabled is False, gather runs the calls one after another on
+        the calling thread, which is the plain synchronous path.
+        """
+        self.max_workers = max_workers
+        self.enabled = enabled
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='io')
+        return self._executor
+
+    def gather(self, *calls):
+        """Run every zero-argument callable in calls and wait for all of
+        them. Each call runs in a copy of the caller's context, so Flask's
+        request and g are available to it
+
+        Return a list of the results in the same order as calls
+        """
+        if not self.enabled or len(calls) < 2:
+            return [call() for call in calls]
+        pool = self._pool()
+        # The first call runs here instead of waiting on a pool thread
+        futures = [pool.submit(contextvars.copy_context().run, call)
+                   for call in calls[1:]]
+        first = calls[0]()
+        return [first] + [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def reset(self):
+        """Forget the executor without joining it. A forked child process
+        has none of its parent's pool threads, so it starts a new pool
+        """
+        self._executor = None
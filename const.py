@@ -7,3 +7,30 @@ TEXT_PLAIN = 'text/plain'
 BASE_LOCAL_URL = 'http://127.0.0.1:8080'
 BASE_GAE_URL = 'https://project-lubranoa.uc.r.appspot.com'
 METHODS = ['POST', 'GET', 'PATCH', 'PUT', 'DELETE']
+# Most entities datastore accepts in a single commit
+MAX_COMMIT_ENTITIES = 500
+# Most keys datastore accepts in a single lookup
+MAX_LOOKUP_KEYS = 1000
+# Most items accepted by the batch endpoints
+MAX_BATCH_ITEMS = 500
+# Most values datastore accepts in one IN filter
+MAX_IN_VALUES = 30
+# Count cache kind of the /boats/aggregate results, which depend on both
+# boats and loads
+BOATS_AGGREGATE = 'boats_aggregate'
+PAGE_CURSOR = 'cursor'
+PAGE_OFFSET = 'offset'
+PAGE_ARGS = ['limit', 'cursor', 'offset']
+# Ways a boat's loads can be stored: as a 'loads' list of IDs on the boat,
+# or only as the 'carrier' of each load
+LOADS_ARRAY = 'array'
+LOADS_CARRIER = 'carrier'
+# Methods whose responses are replayed for a repeated Idempotency-Key
+WRITE_METHODS = ['POST', 'PATCH', 'PUT', 'DELETE']
+# Datastore kind of the stored responses to Idempotency-Key requests
+IDEMPOTENCY = 'idempotency'
+# Datastore kind of the change log records read by the /changes feed
+CHANGES = 'changes'
+EVENT_STREAM = 'text/event-stream'
+# Most change records returned or read at once by the /changes feed
+MAX_CHANGES_PAGE = 500
@@ -0,0 +1,167 @@
+# A read-through cache of datastore entities with pluggable storage backends
+
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class CacheBackend():
+    """Interface for the storage behind an EntityCache. A shared cache such
+    as memcached or Redis can be used by implementing these three methods
+    and pickling the stored values
+    """
+
+    def get(self, key):
+        """Return the value stored for key, or None if there is none"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds"""
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """Remove every key in keys"""
+        raise NotImplementedError
+
+    def add(self, key, value, ttl):
+        """Store value under key for ttl seconds unless a value is already
+        stored there. This version is not atomic, so a shared backend
+        should override it
+
+        Return the value already stored, or None if value was stored
+        """
+        existing = self.get(key)
+        if existing is None:
+            self.set(key, value, ttl)
+        return existing
+
+
+class LRUBackend(CacheBackend):
+    def __init__(self, max_size=10000):
+        """Initializes an in-process backend that holds at most max_size
+        values and evicts the least recently used one first
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def add(self, key, value, ttl):
+        # Holds the lock across the check and the store, unlike the
+        # CacheBackend version
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[1]:
+                self._entries.move_to_end(key)
+                return entry[0]
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return None
+
+
+class EntityCache():
+    def __init__(self, backend=None, ttl=30):
+        """Initializes a read-through cache of datastore entities stored in
+        backend for at most ttl seconds. The TTL bounds how long a reader
+        can see an entity that changed outside of this process
+
+        Entities are copied going in and coming out, because handlers add
+        response-only attributes to the entities they read
+        """
+        self.backend = backend if backend is not None else LRUBackend()
+        self.ttl = ttl
+        self.hits = {}
+        self.misses = {}
+
+    @staticmethod
+    def _cache_key(key):
+        return '/'.join(str(part) for part in key.flat_path)
+
+    def get(self, key):
+        """Look up the entity stored under a datastore key
+
+        Return a copy of the cached entity, or None on a miss
+        """
+        entity = self.backend.get(self._cache_key(key))
+        if entity is None:
+            self.misses[key.kind] = self.misses.get(key.kind, 0) + 1
+            return None
+        self.hits[key.kind] = self.hits.get(key.kind, 0) + 1
+        return copy.deepcopy(entity)
+
+    def set(self, entity):
+        """Store a copy of an entity read from datastore"""
+        self.backend.set(self._cache_key(entity.key), copy.deepcopy(entity),
+                         self.ttl)
+
+    def invalidate(self, keys):
+        """Drop the entities stored under every datastore key in keys"""
+        self.backend.delete_many([self._cache_key(key) for key in keys])
+
+    def stats(self):
+        """Return hit and miss counts for each entity kind"""
+        kinds = set(self.hits) | set(self.misses)
+        return {kind: {'hits': self.hits.get(kind, 0),
+                       'misses': self.misses.get(kind, 0)}
+                for kind in kinds}
+
+
+class CountCache():
+    def __init__(self, ttl=10):
+        """Initializes a cache of aggregation query results that keeps each
+        one for at most ttl seconds, and drops every result for a kind as
+        soon as an entity of that kind is written
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, key):
+        """Return the cached result for key under kind, or None"""
+        with self._lock:
+            entry = self._entries.get(kind, {}).get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[kind][key]
+                return None
+            return value
+
+    def set(self, kind, key, value):
+        with self._lock:
+            self._entries.setdefault(kind, {})[key] = (
+                value, time.monotonic() + self.ttl)
+
+    def invalidate_kinds(self, kinds):
+        """Drop every cached result for the kinds in kinds"""
+        with self._lock:
+            for kind in kinds:
+                self._entries.pop(kind, None)
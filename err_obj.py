@@ -13,6 +13,115 @@ MISS_ATTR_ALL_400 = {
     'status': 400
 }
 
+INVALID_BODY_400 = {
+    'msg': {'Error': 'The request body is not a valid JSON object'},
+    'status': 400
+}
+
+INVALID_ATTR_400 = {
+    'msg': {'Error': 'The request object has an attribute of the wrong type'},
+    'status': 400
+}
+
+BAD_CURSOR_400 = {
+    'msg': {'Error': 'The cursor in the request is invalid or expired'},
+    'status': 400
+}
+
+BATCH_NOT_LIST_400 = {
+    'msg': {'Error': 'The request body must be a non-empty array of items'},
+    'status': 400
+}
+
+BATCH_TOO_LARGE_400 = {
+    'msg': {'Error': 'The request contains more than 500 items'},
+    'status': 400
+}
+
+INVALID_ID_400 = {
+    'msg': {'Error': 'The request contains an ID that is not an integer'},
+    'status': 400
+}
+
+INVALID_FILTER_400 = {
+    'msg': {'Error': 'The request contains an invalid filter or sort order'},
+    'status': 400
+}
+
+INDEX_REQUIRED_400 = {
+    'msg': {'Error': 'This combination of filters and sort order is not '
+            'supported'},
+    'status': 400
+}
+
+INVALID_FIELDS_400 = {
+    'msg': {'Error': 'The request asks for a field or embed that does not '
+            'exist'},
+    'status': 400
+}
+
+AUTH_HEADER_MISSING_401 = {
+    'msg': {'code': 'authorization_header_missing',
+            'description': 'Authorization header is expected'},
+    'status': 401
+}
+
+AUTH_NOT_BEARER_401 = {
+    'msg': {'code': 'invalid_header',
+            'description': 'Authorization header must start with Bearer'},
+    'status': 401
+}
+
+AUTH_NO_TOKEN_401 = {
+    'msg': {'code': 'invalid_header',
+            'description': 'Token not found'},
+    'status': 401
+}
+
+AUTH_NOT_BEARER_TOKEN_401 = {
+    'msg': {'code': 'invalid_header',
+            'description': 'Authorization header must be Bearer token'},
+    'status': 401
+}
+
+AUTH_NOT_RS256_401 = {
+    'msg': {'code': 'invalid_header',
+            'description': 'Invalid header.'
+            ' Use an RS256 signed JWT Access Token'},
+    'status': 401
+}
+
+AUTH_TOKEN_EXPIRED_401 = {
+    'msg': {'code': 'token_expired',
+            'description': 'token is expired'},
+    'status': 401
+}
+
+AUTH_INVALID_CLAIMS_401 = {
+    'msg': {'code': 'invalid_claims',
+            'description': 'incorrect claims,'
+            ' please check the audience and issuer'},
+    'status': 401
+}
+
+AUTH_UNPARSABLE_TOKEN_401 = {
+    'msg': {'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'},
+    'status': 401
+}
+
+AUTH_NO_KEY_401 = {
+    'msg': {'code': 'invalid_header',
+            'description': 'Unable to find appropriate key'},
+    'status': 401
+}
+
+AUTH_METRICS_TOKEN_401 = {
+    'msg': {'code': 'invalid_token',
+            'description': 'A valid metrics token is required'},
+    'status': 401
+}
+
 FBD_BOAT_READ_403 = {
     'msg': {'Error': 'User is not allowed to view boats owned by '
             'someone else'},
@@ -76,7 +185,43 @@ WRONG_ACCEPT_406 = {
     'status': 406
 }
 
+TXN_CONFLICT_409 = {
+    'msg': {'Error': 'The request conflicted with concurrent changes to the '
+            'same entities. Try again'},
+    'status': 409
+}
+
+IDEMPOTENCY_IN_PROGRESS_409 = {
+    'msg': {'Error': 'A request with this Idempotency-Key is still being '
+            'processed'},
+    'status': 409
+}
+
+PRECONDITION_FAILED_412 = {
+    'msg': {'Error': 'The resource has changed since the ETag in If-Match '
+            'was issued'},
+    'status': 412
+}
+
 WRONG_TYPE_415 = {
     'msg': {'Error': 'Client sent content in an unsupported MIME type'},
     'status': 415
 }
+
+IDEMPOTENCY_KEY_REUSED_422 = {
+    'msg': {'Error': 'This Idempotency-Key was already used for a different '
+            'request'},
+    'status': 422
+}
+
+TOO_MANY_REQUESTS_429 = {
+    'msg': {'Error': 'Too many requests, please retry after the number of '
+            'seconds in Retry-After'},
+    'status': 429
+}
+
+OVERLOADED_503 = {
+    'msg': {'Error': 'The server is handling too many requests, please retry '
+            'after the number of seconds in Retry-After'},
+    'status': 503
+}
@@ -0,0 +1,61 @@
+# JSON encoding of response bodies through orjson when it is installed, or
+# the standard library json module otherwise
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SEPARATORS = (',', ':')
+
+
+def _default(value):
+    # Values JSON has no type for, such as datastore keys
+    return str(value)
+
+
+def _dumps_json(obj):
+    return json.dumps(obj, sort_keys=True, separators=SEPARATORS,
+                      default=_default)
+
+
+def _dumps_orjson(obj):
+    return orjson.dumps(obj, default=_default,
+                        option=orjson.OPT_SORT_KEYS).decode('utf-8')
+
+
+ENCODERS = {'json': _dumps_json}
+if orjson is not None:
+    ENCODERS['orjson'] = _dumps_orjson
+
+_encoder = ENCODERS.get('orjson', _dumps_json)
+
+
+def use(name):
+    """Switch the encoder dumps() uses to one of the names in ENCODERS. A
+    name that isn't available leaves the current encoder in place
+
+    Return the name of the encoder now in use
+    """
+    global _encoder
+    if name in ENCODERS:
+        _encoder = ENCODERS[name]
+    return current()
+
+
+def current():
+    """Return the name of the encoder dumps() uses"""
+    for name, encoder in ENCODERS.items():
+        if encoder is _encoder:
+            return name
+
+
+def dumps(obj):
+    """Encode obj as compact JSON with sorted keys. Datastore entities are
+    encoded as the dictionaries they are
+
+    Return the JSON text
+    """
+    return _encoder(obj)
@@ -0,0 +1,105 @@
+# Parses the 'fields' and 'embed' request args that choose which attributes
+# of boats and loads a response holds, and maps a field list onto a
+# datastore projection query where an index can serve it
+
+import const
+import err_obj
+
+# Attributes every response keeps, whatever fields are asked for
+ALWAYS = ('id', 'self')
+
+# Attributes of each kind that 'fields' may name besides ALWAYS
+FIELDS = {
+    const.BOATS: ('name', 'type', 'length', 'owner', 'loads'),
+    const.LOADS: ('volume', 'item', 'creation_date', 'carrier')
+}
+
+# Attributes that 'embed' may expand into the full entities they refer to
+EMBEDS = {
+    const.BOATS: ('loads',),
+    const.LOADS: ()
+}
+
+# Attributes stored as arrays, which a projection query would return once
+# per value
+ARRAYS = ('loads',)
+
+
+# Error handling class
+class FieldsetError(Exception):
+    def __init__(self, error):
+        """Holds the err_obj error object describing why the fields or embed
+        args can't be used
+        """
+        self.error = error
+
+
+def _names(value):
+    return set(name.strip() for name in value.split(',') if name.strip())
+
+
+def parse(kind, args):
+    """Read the comma-separated 'fields' and 'embed' args for kind.
+    Embedding an attribute also asks for it
+
+    Return a tuple of (set of fields, or None for every field, set of
+    embedded attributes)
+    """
+    embed = _names(args.get('embed', ''))
+    if not embed <= set(EMBEDS[kind]):
+        raise FieldsetError(err_obj.INVALID_FIELDS_400)
+    if 'fields' not in args:
+        return None, embed
+    fields = _names(args['fields'])
+    if not fields <= set(FIELDS[kind]) | set(ALWAYS):
+        raise FieldsetError(err_obj.INVALID_FIELDS_400)
+    return fields | embed, embed
+
+
+def projection(kind, fields, filters, orders, indexes, equalities=()):
+    """Work out the datastore projection that serves fields for a query
+    with filters and the full sort orders from query_filters.plan. Asking
+    for only ALWAYS attributes needs only the keys. A projection can't hold
+    array attributes or properties held equal by a filter, and needs an
+    index of the equality properties, then the sort orders, then the other
+    projected properties
+
+    Return a list of properties to project, an empty list for a keys-only
+    query, or None if the whole entities must be read
+    """
+    if fields is None:
+        return None
+    props = set(fields) - set(ALWAYS)
+    if not props:
+        return []
+    equal = set(equalities)
+    equal.update(prop for prop, op, value in filters if op == '=')
+    if props & equal or props & set(ARRAYS):
+        return None
+
+    sorted_props = [p for p, d in orders]
+    rest = props - set(sorted_props)
+    # A built-in index serves a query that only involves one property
+    if not equal and len(props | set(sorted_props)) == 1:
+        return sorted(props)
+
+    for index_kind, index_props in indexes:
+        if index_kind != kind or \
+                len(index_props) != len(equal) + len(orders) + len(rest):
+            continue
+        head = index_props[:len(equal)]
+        middle = index_props[len(equal):len(equal) + len(orders)]
+        tail = index_props[len(equal) + len(orders):]
+        if set(p for p, d in head) == equal and middle == orders and \
+                set(p for p, d in tail) == rest:
+            return sorted(props)
+    return None
+
+
+def select(props, fields):
+    """Return the attributes of props in fields or ALWAYS, or all of them
+    if fields is None
+    """
+    if fields is None:
+        return props
+    return {k: v for k, v in props.items() if k in fields or k in ALWAYS}
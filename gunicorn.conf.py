@@ -0,0 +1,72 @@
+# Gunicorn settings for the production entry point in app.yaml
+#
+# Workers are gthread workers. Each worker process runs requests on a pool of
+# threads, which suits these handlers since most of a request is spent
+# waiting on Datastore and Auth0 rather than running Python.
+#
+# GUNICORN_WORKERS and GUNICORN_THREADS set the counts directly. Otherwise
+# they are picked from the available cores and GUNICORN_IO_FRACTION, the
+# share of a request's time spent waiting on I/O. The app's /metrics phase
+# histograms show that share. Set GUNICORN_AUTOTUNE=0 to use one worker
+# per core with a single thread each.
+
+import math
+import os
+
+from os import environ as env
+
+# Ceilings that keep an instance's memory and Datastore connections bounded
+MAX_WORKERS = 8
+MAX_THREADS = 32
+
+
+def available_cores():
+    """Return the number of cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def autotune(cores, io_fraction):
+    """Pick gthread worker and thread counts. One worker per core keeps every
+    core busy running Python. Each thread computes for (1 - io_fraction) of
+    a request, so a core stays busy with 1 / (1 - io_fraction) threads
+
+    Return a tuple of (workers, threads)
+    """
+    io_fraction = min(max(io_fraction, 0.0), 0.95)
+    workers = min(max(cores, 1), MAX_WORKERS)
+    threads = min(max(math.ceil(round(1 / (1 - io_fraction), 6)), 1),
+                  MAX_THREADS)
+    return workers, threads
+
+
+if env.get('GUNICORN_AUTOTUNE', '1') != '0':
+    _workers, _threads = autotune(
+        available_cores(), float(env.get('GUNICORN_IO_FRACTION', '0.8')))
+else:
+    _workers, _threads = available_cores(), 1
+
+bind = '0.0.0.0:' + env.get('PORT', '8080')
+worker_class = 'gthread'
+workers = int(env.get('GUNICORN_WORKERS', _workers))
+threads = int(env.get('GUNICORN_THREADS', _threads))
+timeout = int(env.get('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+# Importing main once in the master lets workers share its memory and start
+# faster. Clients are created per process on first use, and post_fork gives
+# each worker its own I/O pool
+preload_app = env.get('GUNICORN_PRELOAD', '1') != '0'
+accesslog = '-' if env.get('GUNICORN_ACCESS_LOG') == '1' else None
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import main
+        main.init_worker()
+
+
+def when_ready(server):
+    server.log.info('Serving with %d gthread workers of %d threads',
+                    workers, threads)
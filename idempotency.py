@@ -0,0 +1,114 @@
+# Remembers the responses of write requests sent with an Idempotency-Key
+# header, so a client that retries one gets the first response replayed
+# instead of the write being applied twice
+
+import datetime
+import pickle
+
+from google.api_core.exceptions import Conflict
+from google.cloud import datastore
+
+import const
+import entity_cache
+
+# Marks a key whose first request has not finished yet
+IN_PROGRESS = 'in_progress'
+
+
+class DatastoreBackend(entity_cache.CacheBackend):
+    def __init__(self, client, kind=const.IDEMPOTENCY):
+        """Initializes a backend that keeps pickled values in datastore
+        entities of kind, keyed by their cache key, so every process and
+        instance shares them. Each entity gets an 'expire_at' time for a
+        datastore TTL policy to delete it by. Values past it are ignored
+        until then
+        """
+        self.client = client
+        self.kind = kind
+
+    def get(self, key):
+        entity = self.client.get(self.client.key(self.kind, key))
+        if entity is None or \
+                entity['expire_at'] <= datetime.datetime.now(
+                    datetime.timezone.utc):
+            return None
+        return pickle.loads(entity['value'])
+
+    def set(self, key, value, ttl):
+        entity = datastore.Entity(key=self.client.key(self.kind, key),
+                                  exclude_from_indexes=['value'])
+        entity['value'] = pickle.dumps(value)
+        entity['expire_at'] = (datetime.datetime.now(datetime.timezone.utc)
+                               + datetime.timedelta(seconds=ttl))
+        self.client.put(entity)
+
+    def delete_many(self, keys):
+        self.client.delete_multi([self.client.key(self.kind, key)
+                                  for key in keys])
+
+    def add(self, key, value, ttl):
+        """Check for a value and store one in a single transaction, so only
+        one of several processes adding key at once succeeds
+        """
+        try:
+            with self.client.transaction():
+                existing = self.get(key)
+                if existing is None:
+                    self.set(key, value, ttl)
+                return existing
+        except Conflict:
+            # Another process stored a value first
+            existing = self.get(key)
+            return existing if existing is not None else value
+
+
+class IdempotencyStore():
+    def __init__(self, backend=None, ttl=86400, claim_ttl=60):
+        """Initializes a store of finished responses kept for ttl seconds in
+        an entity_cache backend. A claim on a key lapses after claim_ttl
+        seconds if its request never finishes.
+
+        Claims are made with the backend's add. With a DatastoreBackend,
+        claims and finished responses are shared by every process, so only
+        one of two first attempts racing in different processes runs. The
+        default in-process backend only guards against repeats served by
+        the same process. Responses that could not be stored are counted in
+        failed
+        """
+        self.backend = (backend if backend is not None
+                        else entity_cache.LRUBackend())
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self.failed = 0
+
+    def begin(self, key):
+        """Claim key for a request
+
+        Return None if the request should run, IN_PROGRESS if the first
+        request with key is still running, or the stored record of the
+        finished one, a dictionary with 'fingerprint', 'status', 'mimetype',
+        'headers' and 'body'
+        """
+        return self.backend.add(key, IN_PROGRESS, self.claim_ttl)
+
+    def finish(self, key, fingerprint, response):
+        """Store the response to the request that claimed key, along with
+        fingerprint, a hash of that request's method, path and body
+        """
+        headers = {name: response.headers[name]
+                   for name in ('ETag', 'Location')
+                   if name in response.headers}
+        try:
+            self.backend.set(key, {'fingerprint': fingerprint,
+                                   'status': response.status_code,
+                                   'mimetype': response.mimetype,
+                                   'headers': headers,
+                                   'body': response.get_data()}, self.ttl)
+        except Exception:
+            # The write was already applied, so its response must still be
+            # sent. The claim lapses after claim_ttl seconds
+            self.failed += 1
+
+    def abandon(self, key):
+        """Release a claimed key so a retry of its request runs again"""
+        self.backend.delete_many([key])
@@ -0,0 +1,161 @@
+# An in-process store for the Auth0 JSON Web Key Set used in JWT verification
+
+import json
+import threading
+import time
+
+from six.moves.urllib.request import urlopen
+
+
+def fetch_jwks(url, timeout=5):
+    """Default JWKS fetcher. Downloads and parses the key set at url,
+    giving up after timeout seconds
+
+    Return the parsed JWKS dictionary
+    """
+    jsonurl = urlopen(url, timeout=timeout)
+    return json.loads(jsonurl.read())
+
+
+class JWKSCache():
+    def __init__(self, url, ttl=600, min_refresh_interval=30,
+                 refresh_ahead=60, fetcher=fetch_jwks):
+        """Initializes a JWKS key store that keeps the parsed RSA keys in
+        memory for ttl seconds.
+
+        The key set is refetched only when the TTL has expired or when a
+        token names a kid that is not in the store. Refetches caused by
+        unknown kids are rate limited to one per min_refresh_interval
+        seconds. Once an entry is within refresh_ahead seconds of expiring,
+        the next lookup starts a background refresh so callers never wait
+        on Auth0 for a routine rotation. A failed fetch keeps the stored
+        keys and holds off the next attempt for min_refresh_interval
+        seconds.
+
+        The fetcher is any callable that takes the JWKS url and returns the
+        parsed key set, which allows a local stub server or a fixed dict to
+        stand in for Auth0.
+        """
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.refresh_ahead = refresh_ahead
+        self.fetcher = fetcher
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        self._keys = {}
+        self._expires_at = 0.0
+        self._last_fetch = None
+        # Guards the keys and counters
+        self._lock = threading.Lock()
+        # Held for the length of a fetch, so lookups of stored keys never
+        # wait on Auth0
+        self._fetch_lock = threading.Lock()
+        self._bg_refreshing = False
+
+    def _refresh(self):
+        """Fetch the key set without holding the lock, then swap it in.
+        Only one thread fetches at a time, and a thread that waited for
+        another's fetch made at or after since reuses its result
+
+        Must be called without the lock held
+        """
+        since = time.monotonic()
+        with self._fetch_lock:
+            if self._last_fetch is not None and self._last_fetch >= since:
+                return
+            try:
+                jwks = self.fetcher(self.url)
+            except Exception:
+                # Keep the old keys rather than retry on every request
+                # while Auth0 is unreachable
+                now = time.monotonic()
+                with self._lock:
+                    self._expires_at = max(self._expires_at,
+                                           now + self.min_refresh_interval)
+                    self._last_fetch = now
+                raise
+            keys = {}
+            for key in jwks.get('keys', []):
+                keys[key['kid']] = {
+                    'kty': key['kty'],
+                    'kid': key['kid'],
+                    'use': key['use'],
+                    'n': key['n'],
+                    'e': key['e']
+                }
+            now = time.monotonic()
+            with self._lock:
+                self._keys = keys
+                self._expires_at = now + self.ttl
+                self._last_fetch = now
+                self.refreshes += 1
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception:
+            self.refresh_errors += 1
+        finally:
+            self._bg_refreshing = False
+
+    def _start_background_refresh(self):
+        if self._bg_refreshing:
+            return
+        self._bg_refreshing = True
+        thread = threading.Thread(target=self._background_refresh,
+                                  daemon=True)
+        thread.start()
+
+    def get_key(self, kid):
+        """Look up the RSA key for kid, fetching the key set if it has
+        expired or if kid is unknown and the rate limit allows it
+
+        Return a key dictionary usable by jwt.decode, or None if no key
+        with that kid exists
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = now >= self._expires_at
+            key = self._keys.get(kid)
+            if expired or key is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self._expires_at - now <= self.refresh_ahead and \
+                        now - self._last_fetch >= self.min_refresh_interval:
+                    self._start_background_refresh()
+                return key
+            may_fetch = (self._last_fetch is None or now - self._last_fetch
+                         >= self.min_refresh_interval)
+
+        if expired or may_fetch:
+            try:
+                self._refresh()
+            except Exception:
+                # Keep serving the stale keys if Auth0 is unreachable
+                self.refresh_errors += 1
+                if not self._keys:
+                    raise
+        with self._lock:
+            return self._keys.get(kid)
+
+    def invalidate(self):
+        """Drop the stored keys so the next lookup refetches them"""
+        with self._lock:
+            self._keys = {}
+            self._expires_at = 0.0
+
+    def stats(self):
+        """Return a dictionary of hit, miss and refresh counters"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'keys': len(self._keys)
+        }
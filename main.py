@@ -7,22 +7,46 @@
 # TODO: Add authentication to load routes
 # TODO: Add comments
 
+import hashlib
+import hmac
 import json
+import random
+import threading
+import time
+import admission
+import changelog
+import compression
+import concurrent_io
 import const
+import entity_cache
 import err_obj
-
+import fast_json
+import fieldsets
+import idempotency
+import jwks_cache
+import metrics
+import process_local
+import query_filters
+import representation
+import schemas
+import token_cache
+import webhooks
+
+from contextlib import contextmanager
 from os import environ as env
+from os.path import abspath, dirname, join
 from urllib.parse import quote_plus, urlencode
 
 from authlib.integrations.flask_client import OAuth
 from dotenv import find_dotenv, load_dotenv
 
 from flask import Flask, redirect, render_template, session, make_response
-from flask import url_for, request, jsonify, _request_ctx_stack
+from flask import Response, g, has_request_context
+from flask import url_for, request, _request_ctx_stack
 
-from six.moves.urllib.request import urlopen
 from jose import jwt
 
+from google.api_core.exceptions import BadRequest, Conflict
 from google.cloud import datastore
 
 # -------------------------------------------------------------------------------
@@ -47,10 +71,158 @@ ALGORITHMS = ['RS256']
 
 app = Flask(__name__)
 app.secret_key = env.get('APP_SECRET_KEY')
-client = datastore.Client()
+# Created on first use in each process, so importing main stays cheap and a
+# forked worker never shares its parent's gRPC channels
+client = process_local.ProcessLocal(datastore.Client)
 
 BASE_URL = const.BASE_GAE_URL
 
+# Composite indexes available to the collection filters
+INDEXES = query_filters.load_indexes(
+    join(dirname(abspath(__file__)), 'index.yaml'))
+
+
+# Seconds to wait for Auth0 when fetching its signing keys
+JWKS_TIMEOUT = float(env.get('JWKS_TIMEOUT', '5'))
+
+
+# Parsed Auth0 signing keys, kept in memory so verify_jwt does not fetch the
+# key set on every request
+def fetch_jwks(url):
+    with metrics.timed('jwks'):
+        return jwks_cache.fetch_jwks(url, JWKS_TIMEOUT)
+
+
+jwks_store = jwks_cache.JWKSCache(
+    env.get('AUTH0_JWKS_URL',
+            'https://' + AUTH0_DOMAIN + '/.well-known/jwks.json'),
+    fetcher=fetch_jwks,
+    ttl=int(env.get('JWKS_TTL', '600')),
+    min_refresh_interval=int(env.get('JWKS_MIN_REFRESH', '30')))
+
+# Payloads of already verified access tokens, so repeat callers skip the
+# RS256 signature check
+token_store = token_cache.TokenCache(
+    max_size=int(env.get('TOKEN_CACHE_SIZE', '10000')),
+    max_bytes=int(env.get('TOKEN_CACHE_BYTES', str(16 * 1024 * 1024))))
+
+# Read-through cache in front of get_entity. Every put and delete below goes
+# through the helpers that invalidate it, but only in this process, so a
+# plain GET may see another worker's write up to ENTITY_CACHE_TTL seconds
+# late. Writes and conditional requests don't read it
+entity_store = entity_cache.EntityCache(
+    entity_cache.LRUBackend(int(env.get('ENTITY_CACHE_SIZE', '10000'))),
+    ttl=int(env.get('ENTITY_CACHE_TTL', '5')))
+# Keys written by the transaction running on this thread, if any
+_txn_writes = threading.local()
+
+# Independent lookups of a request, such as verify_jwt and the entity gets,
+# run at the same time unless CONCURRENT_IO is set to 0
+io_pool = concurrent_io.IOPool(
+    max_workers=int(env.get('IO_POOL_SIZE', '16')),
+    enabled=env.get('CONCURRENT_IO', '1') != '0')
+
+# Short-lived results of count and sum aggregation queries
+count_store = entity_cache.CountCache(
+    ttl=int(env.get('COUNT_CACHE_TTL', '10')))
+
+# How the loads on each boat are stored. In 'carrier' mode the boat holds no
+# 'loads' list and only a load's 'carrier' records the boat it is on, so
+# requests loading one boat never write the same entity.
+# migrate_boat_loads.py converts stored boats between the two modes
+LOADS_MODE = env.get('BOAT_LOADS_MODE', const.LOADS_ARRAY)
+
+# A transaction that fails because a concurrent one wrote the same entities
+# is run again, up to TXN_MAX_ATTEMPTS times in all, with exponential
+# backoff between attempts
+TXN_MAX_ATTEMPTS = int(env.get('TXN_MAX_ATTEMPTS', '5'))
+TXN_BACKOFF_BASE = float(env.get('TXN_BACKOFF_BASE', '0.05'))
+TXN_BACKOFF_MAX = float(env.get('TXN_BACKOFF_MAX', '1.0'))
+
+# Responses to write requests sent with an Idempotency-Key header. They are
+# kept in datastore, shared by every instance, unless IDEMPOTENCY_STORE is
+# 'memory', which keeps them in this process only
+if env.get('IDEMPOTENCY_STORE', 'datastore') == 'memory':
+    idempotency_backend = entity_cache.LRUBackend()
+else:
+    idempotency_backend = idempotency.DatastoreBackend(client)
+idempotency_store = idempotency.IdempotencyStore(
+    idempotency_backend, ttl=int(env.get('IDEMPOTENCY_TTL', '86400')))
+
+# Callers over their rate limit get a 429 and requests beyond MAX_IN_FLIGHT
+# at once in this process a 503, before any token is verified. Callers with
+# a verified token are limited by its subject, and every other caller by
+# client address. A rate or MAX_IN_FLIGHT of 0 turns that limit off
+admission_control = admission.AdmissionControl(
+    limits={
+        'subject': (float(env.get('RATE_LIMIT_SUBJECT', '0')),
+                    int(env.get('RATE_LIMIT_SUBJECT_BURST', '20'))),
+        'ip': (float(env.get('RATE_LIMIT_IP', '0')),
+               int(env.get('RATE_LIMIT_IP_BURST', '50')))},
+    max_in_flight=int(env.get('MAX_IN_FLIGHT', '0')))
+# Proxies in front of the app that append to X-Forwarded-For
+TRUSTED_PROXIES = int(env.get('TRUSTED_PROXIES', '0'))
+# Routes that are never limited
+ADMISSION_EXEMPT = ('metrics_get',)
+# Bearer token a scraper must send to read /metrics, which is exempt from
+# admission control. /metrics answers 401 to every request if it is unset
+METRICS_TOKEN = env.get('METRICS_TOKEN')
+
+# Every write appends change records to a log read through /changes. The
+# log is kept in datastore, shared by every instance, unless CHANGE_LOG is
+# 'memory', which keeps it in this process only
+if env.get('CHANGE_LOG', 'datastore') == 'memory':
+    change_backend = changelog.MemoryLogBackend()
+else:
+    change_backend = changelog.DatastoreLogBackend(
+        client, retention=int(env.get('CHANGES_RETENTION', '604800')))
+change_log = changelog.ChangeLog(
+    change_backend, settle=float(env.get('CHANGES_SETTLE', '2.0')))
+# Longest a /changes long poll waits, and how often it and an event stream
+# read the log. Records only appear once settled, so polling much more
+# often than CHANGES_SETTLE only adds reads
+CHANGES_MAX_WAIT = float(env.get('CHANGES_MAX_WAIT', '25'))
+CHANGES_POLL_INTERVAL = float(env.get('CHANGES_POLL_INTERVAL', '2.0'))
+# Each long poll and event stream holds a worker thread while it waits, so
+# at most MAX_CHANGE_WAITERS of them run at once in this process
+change_waiters = admission.AdmissionControl(
+    max_in_flight=int(env.get('MAX_CHANGE_WAITERS', '2')))
+# Longest a /changes event stream stays open before the client reconnects,
+# and the most time between two messages on it
+CHANGES_STREAM_SECONDS = float(env.get('CHANGES_STREAM_SECONDS', '55'))
+CHANGES_HEARTBEAT = float(env.get('CHANGES_HEARTBEAT', '15'))
+
+# If WEBHOOK_URL is set, a thread in each process also POSTs the change
+# records made by that process to it in batches
+webhook_sender = None
+if env.get('WEBHOOK_URL'):
+    webhook_sender = process_local.ProcessLocal(
+        lambda: webhooks.WebhookSender(
+            env.get('WEBHOOK_URL'), secret=env.get('WEBHOOK_SECRET'),
+            batch_size=int(env.get('WEBHOOK_BATCH_SIZE', '100')),
+            interval=float(env.get('WEBHOOK_INTERVAL', '1.0')),
+            max_attempts=int(env.get('WEBHOOK_MAX_ATTEMPTS', '5'))))
+
+# JSON and text responses of at least COMPRESS_MIN_SIZE bytes are sent
+# with gzip or brotli when the client accepts it, unless COMPRESSION is 0
+compressor = None
+if env.get('COMPRESSION', '1') != '0':
+    compressor = compression.Compressor(
+        min_size=int(env.get('COMPRESS_MIN_SIZE', '1024')),
+        level=int(env.get('COMPRESS_LEVEL', '6')),
+        brotli_quality=int(env.get('BROTLI_QUALITY', '4')))
+
+# Response bodies are encoded with orjson when it is installed, unless
+# JSON_ENCODER names another encoder in fast_json.ENCODERS
+fast_json.use(env.get('JSON_ENCODER', fast_json.current()))
+
+# The error messages in err_obj never change, so their response bodies are
+# encoded once here and looked up by the identity of the message
+ERROR_BODIES = {
+    id(error['msg']): (fast_json.dumps(error['msg']) + '\n').encode('utf-8')
+    for name, error in vars(err_obj).items()
+    if name.isupper() and isinstance(error, dict) and 'msg' in error}
+
 
 # Error handling class
 class AuthError(Exception):
@@ -77,46 +249,312 @@ class Result():
         self.token = token
 
 
-oauth = OAuth(app)
+def register_oauth():
+    """Return a new OAuth registry for app with the Auth0 client registered.
+    The OIDC metadata at server_metadata_url is fetched by authlib the first
+    time /login or /callback needs it
+    """
+    registry = OAuth(app)
+    registry.register(
+        'auth0',
+        client_id=AUTH0_CLIENT_ID,
+        client_secret=AUTH0_CLIENT_SECRET,
+        api_base_url='https://' + AUTH0_DOMAIN,
+        access_token_url='https://' + AUTH0_DOMAIN + '/oauth/token',
+        authorize_url='https://' + AUTH0_DOMAIN + '/authorize',
+        client_kwargs={
+            'scope': 'openid profile email',
+        },
+        server_metadata_url=f'https://{AUTH0_DOMAIN}'
+                            '/.well-known/openid-configuration'
+    )
+    return registry
+
+
+oauth = process_local.ProcessLocal(register_oauth)
+
+
+def init_worker():
+    """Give a forked server worker its own I/O pool, since threads made
+    before a fork don't exist in the child. The datastore client and OAuth
+    registry are per-process already. gunicorn.conf.py calls this after
+    forking each worker
+    """
+    io_pool.reset()
 
-oauth.register(
-    'auth0',
-    client_id=AUTH0_CLIENT_ID,
-    client_secret=AUTH0_CLIENT_SECRET,
-    api_base_url='https://' + AUTH0_DOMAIN,
-    access_token_url='https://' + AUTH0_DOMAIN + '/oauth/token',
-    authorize_url='https://' + AUTH0_DOMAIN + '/authorize',
-    client_kwargs={
-        'scope': 'openid profile email',
-    },
-    server_metadata_url=f'https://{AUTH0_DOMAIN}'
-                        '/.well-known/openid-configuration'
-)
+
+def encode_body(content):
+    """Encode content as a JSON response body. The bodies of the err_obj
+    error messages are encoded once, when the app starts
+
+    Return the body as bytes
+    """
+    body = ERROR_BODIES.get(id(content))
+    if body is None:
+        with metrics.timed('json'):
+            body = (fast_json.dumps(content) + '\n').encode('utf-8')
+    return body
 
 
 def get_auth_error_resp(err):
     """Create an authorization error response object"""
-    response = make_response(jsonify(err.error))
-    response.status_code = err.status_code
-    return response
+    return Response(encode_body(err.error), status=err.status_code,
+                    mimetype=const.APP_JSON)
 
 
-def get_resp(content, status, make_json=True):
+def get_resp(content, status, make_json=True, etag=None):
     """Create a general response object"""
-    response = make_response(jsonify(content))
+    response = Response(encode_body(content), status=status,
+                        mimetype=const.APP_JSON if make_json
+                        else const.TEXT_PLAIN)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def get_json_resp(body, status, etag=None):
+    """Create a response from JSON text that is already encoded"""
+    response = make_response(body + '\n')
     response.status_code = status
-    if not make_json:
-        response.mimetype = const.TEXT_PLAIN
+    response.mimetype = const.APP_JSON
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def get_stream_resp(chunks, status=200):
+    """Create a response that sends JSON text as a generator produces it"""
+    return Response(chunks, status=status, mimetype=const.APP_JSON)
+
+
+def wants_stream():
+    """Return True if the request asks for a whole collection streamed
+    instead of one page
+    """
+    return request.args.get('stream', '').lower() in ('1', 'true')
+
+
+def encode_boat(boat, load_ids=None, fields=None, loads=None):
+    with metrics.timed('json'):
+        return representation.boat_json(boat, BASE_URL, load_ids, fields,
+                                        loads)
+
+
+def encode_load(load, fields=None):
+    with metrics.timed('json'):
+        return representation.load_json(load, BASE_URL, fields)
+
+
+def encode_user(user):
+    with metrics.timed('json'):
+        return representation.user_json(user)
+
+
+def get_not_modified_resp(etag):
+    """Create an empty 304 response for a conditional GET. etag should be
+    the form of the ETag the client sent, which may carry an encoding
+    suffix
+    """
+    response = make_response('', 304)
+    response.set_etag(etag)
     return response
 
 
+def entity_etag(entity):
+    """Compute an entity's version as a hash of its stored attributes. Must
+    be called before any response-only attributes are added
+
+    Return the hash as a hex string
+    """
+    content = json.dumps(entity, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def boat_etag(boat, load_ids):
+    """Compute a boat's ETag from its stored attributes and the IDs of the
+    loads on it, so loading or unloading it changes the ETag in either
+    storage mode. In array mode this is the same as entity_etag(boat)
+
+    Return the hash as a hex string
+    """
+    return entity_etag(dict(boat, loads=load_ids))
+
+
+def etag_matches(entity, load_ids=None):
+    """Check the request's If-Match header against an entity, which should
+    have been read inside the transaction that will write it. For a boat in
+    carrier mode, load_ids holds the IDs of the loads on it
+
+    Return True if there is no If-Match header or the entity's current
+    ETag satisfies it
+    """
+    if not request.if_match:
+        return True
+    if entity is None:
+        return False
+    if load_ids is not None:
+        etag = boat_etag(entity, load_ids)
+    else:
+        etag = entity_etag(entity)
+    # A compressed response's ETag carries the encoding as a suffix
+    return compression.matching_etag(etag, request.if_match) is not None
+
+
+def in_transaction():
+    """Return True if a datastore transaction is active on this thread"""
+    return client.current_transaction is not None
+
+
+def fresh_read():
+    """Return True if the current request must read the datastore rather
+    than the entity cache. Another worker may have changed an entity since
+    this process cached it, so writes, whose checks would act on a stale
+    copy, and conditional requests, which would compare the client's ETag
+    with one, skip the cache
+    """
+    return has_request_context() and (
+        request.method in const.WRITE_METHODS or
+        bool(request.if_none_match or request.if_match))
+
+
 def get_entity(entity, id):
-    """Helper method for retrieving an entity stored on datastore
+    """Helper method for retrieving an entity stored on datastore. Reads
+    outside of a transaction are served from the entity cache if possible,
+    unless fresh_read() says otherwise
 
     Return a datastore object
     """
     key = client.key(entity, id)
-    return client.get(key)
+    if in_transaction():
+        with metrics.timed('ds_get'):
+            return client.get(key)
+    cached = None if fresh_read() else entity_store.get(key)
+    if cached is not None:
+        return cached
+    with metrics.timed('ds_get'):
+        found = client.get(key)
+    if found is not None:
+        entity_store.set(found)
+    return found
+
+
+def get_entities(keys):
+    """Retrieve many entities with a single get_multi lookup for the keys
+    missing from the entity cache, or for every key if fresh_read() says
+    so. Keys may be of different kinds
+
+    Return a list of the datastore objects found, in no particular order
+    """
+    if in_transaction():
+        with metrics.timed('ds_get'):
+            return client.get_multi(keys)
+    found = []
+    missing = []
+    fresh = fresh_read()
+    for key in keys:
+        cached = None if fresh else entity_store.get(key)
+        if cached is not None:
+            found.append(cached)
+        else:
+            missing.append(key)
+    if missing:
+        with metrics.timed('ds_get'):
+            missing = client.get_multi(missing)
+        for entity in missing:
+            entity_store.set(entity)
+            found.append(entity)
+    return found
+
+
+def stale_count_kinds(keys):
+    """Return the kinds whose cached counts are stale once keys are
+    written. In carrier mode writing a load also changes boat totals, since
+    the boat itself is not written. Writing either kind changes the
+    /boats/aggregate totals, such as the volume of the loads on boats
+    """
+    kinds = set(key.kind for key in keys)
+    if LOADS_MODE == const.LOADS_CARRIER and const.LOADS in kinds:
+        kinds.add(const.BOATS)
+    if kinds & {const.BOATS, const.LOADS}:
+        kinds.add(const.BOATS_AGGREGATE)
+    return kinds
+
+
+def invalidate(keys):
+    """Drop written keys from the entity cache. Inside a transaction the
+    keys are dropped again once it ends, so a read made before the commit
+    can't leave the old entity cached
+    """
+    entity_store.invalidate(keys)
+    count_store.invalidate_kinds(stale_count_kinds(keys))
+    pending = getattr(_txn_writes, 'keys', None)
+    if pending is not None:
+        pending.extend(keys)
+
+
+@contextmanager
+def transaction():
+    """Run a datastore transaction and invalidate every entity written in
+    it from the entity cache after it commits or rolls back
+    """
+    _txn_writes.keys = []
+    try:
+        with metrics.timed('ds_txn'), client.transaction():
+            yield
+    finally:
+        keys = _txn_writes.keys
+        _txn_writes.keys = None
+        entity_store.invalidate(keys)
+        count_store.invalidate_kinds(stale_count_kinds(keys))
+
+
+def run_transaction(work, *args):
+    """Run work(*args) inside transaction(). If it fails because a
+    concurrent transaction wrote the same entities, work runs again in a new
+    transaction after an exponential backoff with jitter, up to
+    TXN_MAX_ATTEMPTS attempts. work should read the entities it writes
+    inside the transaction, so that a retry sees the other writer's changes
+
+    Return what work returns
+    """
+    route = metrics.route_label()
+    for attempt in range(1, TXN_MAX_ATTEMPTS + 1):
+        try:
+            with transaction():
+                return work(*args)
+        except Conflict:
+            metrics.registry.count_txn_event(route, 'conflict')
+            if attempt == TXN_MAX_ATTEMPTS:
+                metrics.registry.count_txn_event(route, 'failure')
+                raise
+        metrics.registry.count_txn_event(route, 'retry')
+        delay = min(TXN_BACKOFF_MAX, TXN_BACKOFF_BASE * 2 ** (attempt - 1))
+        with metrics.timed('txn_backoff'):
+            time.sleep(random.uniform(0, delay))
+
+
+def put_entity(entity):
+    with metrics.timed('ds_put'):
+        client.put(entity)
+    invalidate([entity.key])
+
+
+def put_entities(entities):
+    with metrics.timed('ds_put'):
+        client.put_multi(entities)
+    invalidate([entity.key for entity in entities])
+
+
+def delete_entity(key):
+    with metrics.timed('ds_delete'):
+        client.delete(key)
+    invalidate([key])
+
+
+def delete_entities(keys):
+    with metrics.timed('ds_delete'):
+        client.delete_multi(keys)
+    invalidate(keys)
 
 
 def create_entity(key_val, info, id=None):
@@ -126,22 +564,628 @@ def create_entity(key_val, info, id=None):
         new_key = client.key(key_val, id)
     entity = datastore.Entity(key=new_key)
     entity.update(info)
-    client.put(entity)
+    put_entity(entity)
     return entity
 
 
-def construct_loads(loads):
-    """Construct a loads list from a list of load ID values for boat
-    response objects
+def record_change(op, kind, id, owner=None, boat_id=None):
+    """Add a change record for a committed write to the current request.
+    The records are stored in the change log once the response is ready.
+    op is 'create', 'update', 'delete', 'assign' or 'remove', the last two
+    for a load put on or taken off the boat boat_id. Records with an owner
+    are only shown to that user in the /changes feed
+    """
+    record = {'op': op, 'kind': kind, 'id': int(id),
+              'self': BASE_URL + '/' + kind + '/' + str(id)}
+    if owner is not None:
+        record['owner'] = owner
+    if boat_id is not None:
+        record['boat_id'] = int(boat_id)
+    g.setdefault('changes', []).append(record)
+
+
+def batched(items, size=const.MAX_COMMIT_ENTITIES):
+    """Split a list of entities or keys into lists of at most size items so
+    that each one fits in a single datastore commit
+
+    Return a list of lists
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def delete_boat(boat):
+    """Unload every load carried by a boat and delete the boat
+
+    Loads are written back with put_multi in batches that fit in one
+    commit. The boat is deleted in the same transaction as the last batch,
+    which reads the boat again and unloads any load put on it since the
+    loads were queried, so a boat carrying fewer than
+    const.MAX_COMMIT_ENTITIES loads is unloaded and deleted atomically.
+    With more loads the delete is not atomic: if a later batch fails, the
+    loads unloaded by earlier batches stay unloaded while the boat remains.
+    """
+    size = const.MAX_COMMIT_ENTITIES - 1
+    queried = set(query_load_ids(boat.key.id))
+
+    def unload(batch):
+        # Read the loads again in the transaction and only unload those
+        # still on this boat, since one may have moved since the query
+        loads = [load for load in get_entities(batch)
+                 if load['carrier'] == boat.key.id]
+        for load in loads:
+            load['carrier'] = None
+        if loads:
+            put_entities(loads)
+        return [load.key.id for load in loads]
+
+    def unload_last_and_delete(batch):
+        # Reading the boat makes a concurrent put of a load on it conflict
+        # in array mode. In carrier mode only the load is written, so the
+        # carrier query runs again in this transaction instead
+        current = get_entity(const.BOATS, boat.key.id)
+        if current is None:
+            return [], []
+        if LOADS_MODE == const.LOADS_CARRIER:
+            load_ids = query_load_ids(boat.key.id)
+        else:
+            load_ids = current['loads']
+        extra = [client.key(const.LOADS, id) for id in load_ids
+                 if id not in queried]
+        if len(batch) + len(extra) > size:
+            # Too many to unload in this commit, so nothing is written
+            return extra, []
+        unloaded = unload(batch + extra)
+        delete_entity(boat.key)
+        return [], unloaded
+
+    # Leave room for the boat delete in the final commit
+    keys = [client.key(const.LOADS, id) for id in sorted(queried)]
+    batches = batched(keys, size) or [[]]
+    unloaded = []
+    for batch in batches[:-1]:
+        unloaded += run_transaction(unload, batch)
+    while True:
+        extra, last_unloaded = run_transaction(unload_last_and_delete,
+                                               batches[-1])
+        unloaded += last_unloaded
+        if not extra:
+            break
+        # Unload the loads put on the boat since the query, then try again
+        for batch in batched(extra, size):
+            unloaded += run_transaction(unload, batch)
+        queried.update(key.id for key in extra)
+    for load_id in unloaded:
+        record_change('remove', const.LOADS, load_id, boat['owner'],
+                      boat.key.id)
+    record_change('delete', const.BOATS, boat.key.id, boat['owner'])
+
+
+def query_load_ids(boat_id):
+    """Find the loads whose 'carrier' is a boat with a keys-only query
+
+    Return a sorted list of load IDs
+    """
+    query = client.query(kind=const.LOADS)
+    query.add_filter('carrier', '=', boat_id)
+    query.keys_only()
+    with metrics.timed('ds_query'):
+        return sorted(load.key.id for load in query.fetch())
+
+
+def query_carrier_ids(boat_ids):
+    """Find which of boat_ids are the 'carrier' of any load, with one IN
+    query per const.MAX_IN_VALUES boats
+
+    Return a set of boat IDs
+    """
+    carriers = set()
+    for batch in batched(boat_ids, const.MAX_IN_VALUES):
+        query = client.query(kind=const.LOADS)
+        query.add_filter('carrier', 'IN', batch)
+        with metrics.timed('ds_query'):
+            carriers.update(load['carrier'] for load in query.fetch())
+    return carriers
+
+
+def carried_load_ids(boat):
+    """Return the IDs of the loads on a boat, from its 'loads' list in
+    array mode or from the loads' 'carrier' index in carrier mode
+    """
+    if LOADS_MODE == const.LOADS_CARRIER:
+        return query_load_ids(boat.key.id)
+    return boat.get('loads') or []
+
+
+def carried_load_ids_multi(boats):
+    """Run carried_load_ids for every boat, with the carrier mode queries
+    running at the same time
+
+    Return a dictionary that maps each boat ID to its load IDs
+    """
+    load_ids = io_pool.gather(*[lambda boat=boat: carried_load_ids(boat)
+                                for boat in boats])
+    return {boat.key.id: ids for boat, ids in zip(boats, load_ids)}
+
+
+def split_boat_load(found, boat_key):
+    """Tell apart the boat and the load in the result of looking up a boat
+    key and a load key together
+
+    Return a tuple of (boat, load), where either is None if not found
+    """
+    boat = None
+    load = None
+    for entity in found:
+        if entity.key == boat_key:
+            boat = entity
+        else:
+            load = entity
+    return boat, load
+
+
+def put_load_error(boat, load):
+    """Check whether load can be put on boat
+
+    Return an err_obj error object, or None if it can
+    """
+    if load['carrier'] is not None:
+        if int(load['carrier']) != int(boat.key.id):
+            return err_obj.FBD_LOAD_LOADED_403
+        elif LOADS_MODE == const.LOADS_CARRIER or \
+                int(load.key.id) in boat['loads']:
+            return err_obj.FBD_LOAD_LOADED_403
+    return None
+
 
-    Return a list of load dictionaries with the attributes 'id' and 'self'
+def new_boat_attrs(owner):
+    """Return the attributes the API itself sets on a new boat"""
+    attrs = {'owner': owner}
+    if LOADS_MODE == const.LOADS_ARRAY:
+        attrs['loads'] = []
+    return attrs
+
+
+def get_multi_by_id(kind, ids):
+    """Retrieve many entities of one kind with a single get_multi lookup
+
+    Return a dictionary that maps each ID found to its datastore object
+    """
+    keys = [client.key(kind, id) for id in ids]
+    found = {}
+    for batch in batched(keys, const.MAX_LOOKUP_KEYS):
+        for entity in get_entities(batch):
+            found[entity.key.id] = entity
+    return found
+
+
+def ordered_loads(found, load_ids):
+    """Return the loads in found, a dictionary of load ID to load, in the
+    order of load_ids
+    """
+    return [found[id] for id in load_ids if id in found]
+
+
+def boat_encoder(boats, fields=None, embed=()):
+    """Prepare to encode boats, looking up the loads on them only if the
+    fields include 'loads'. Loads to embed are read for every boat together
+    with batched get_multi lookups
+
+    Return a function that encodes one of the boats
+    """
+    if fields is not None and 'loads' not in fields:
+        return lambda boat: encode_boat(boat, fields=fields)
+    load_ids = carried_load_ids_multi(boats)
+    if 'loads' not in embed:
+        return lambda boat: encode_boat(boat, load_ids[boat.key.id], fields)
+    found = get_multi_by_id(
+        const.LOADS, list(set(id for ids in load_ids.values() for id in ids)))
+    return lambda boat: encode_boat(
+        boat, load_ids[boat.key.id], fields,
+        ordered_loads(found, load_ids[boat.key.id]))
+
+
+def item_error(err, id=None):
+    """Create a per-item result for a batch response from an err_obj error
+    object
     """
-    load_arr = []
-    for load_id in loads:
-        load_arr.append({
-            "id": int(load_id),
-            "self": BASE_URL + '/loads/' + str(load_id)})
-    return load_arr
+    result = {'status': err['status']}
+    if id is not None:
+        result['id'] = id
+    result.update(err['msg'])
+    return result
+
+
+def item_id(item):
+    """Read the integer ID of a batch item, which may be a bare ID or an
+    object with an 'id' attribute
+
+    Return the ID, or None if the item has no usable ID
+    """
+    if isinstance(item, dict):
+        item = item.get('id')
+    try:
+        return int(item)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_batch(items):
+    """Check that a batch request body is a non-empty list within the batch
+    size limit
+
+    Return an error response, or None if the batch can be processed
+    """
+    if not isinstance(items, list) or len(items) < 1:
+        return get_resp(err_obj.BATCH_NOT_LIST_400['msg'],
+                        err_obj.BATCH_NOT_LIST_400['status'])
+    if len(items) > const.MAX_BATCH_ITEMS:
+        return get_resp(err_obj.BATCH_TOO_LARGE_400['msg'],
+                        err_obj.BATCH_TOO_LARGE_400['status'])
+    return None
+
+
+def create_entities(kind, items, defaults):
+    """Create an entity for every valid item in a batch. IDs are allocated
+    in one call and the entities are written with put_multi
+
+    Each item must pass the schema of kind. The defaults dictionary holds
+    the attributes the API sets itself, such as 'owner' or 'carrier'
+
+    Return a list of per-item results in the same order as items
+    """
+    results = [None] * len(items)
+    valid = []
+    values = {}
+    for i, item in enumerate(items):
+        try:
+            values[i] = schemas.check_item(kind, item)
+        except schemas.ValidationError as err:
+            results[i] = item_error(err.error)
+        else:
+            valid.append(i)
+    if not valid:
+        return results
+
+    with metrics.timed('ds_allocate'):
+        keys = client.allocate_ids(client.key(kind), len(valid))
+    entities = []
+    for i, key in zip(valid, keys):
+        entity = datastore.Entity(key=key)
+        entity.update(values[i])
+        # Copy mutable defaults so entities don't share one list
+        entity.update({k: (list(v) if isinstance(v, list) else v)
+                       for k, v in defaults.items()})
+        entities.append(entity)
+    for batch in batched(entities):
+        put_entities(batch)
+
+    for i, entity in zip(valid, entities):
+        record_change('create', kind, entity.key.id, entity.get('owner'))
+        entity['id'] = entity.key.id
+        entity['self'] = BASE_URL + '/' + kind + '/' + str(entity.key.id)
+        results[i] = dict(entity, status=201)
+    return results
+
+
+def update_entities(kind, items, not_found, owner=None, forbidden=None):
+    """Partially update every item in a batch, where each item holds an 'id'
+    and the attributes to change. The entities are read with get_multi
+    inside one transaction per commit-sized batch, changed and written back
+    with put_multi
+
+    If owner is given, entities whose 'owner' differs get the forbidden
+    error instead of being updated
+
+    Return a list of per-item results in the same order as items
+    """
+    results = [None] * len(items)
+    ids = [item_id(item) for item in items]
+    found = get_multi_by_id(kind, [id for id in ids if id is not None])
+
+    # The changes for each entity, merged in item order, since the same
+    # entity may appear more than once
+    changes = {}
+    pending = []
+    for i, (item, id) in enumerate(zip(items, ids)):
+        if id is None or not isinstance(item, dict):
+            results[i] = item_error(err_obj.MISS_ATTR_ONE_400)
+            continue
+        entity = found.get(id)
+        if entity is None:
+            results[i] = item_error(not_found, id)
+            continue
+        if owner is not None and entity['owner'] != owner:
+            results[i] = item_error(forbidden, id)
+            continue
+        try:
+            item_changes = schemas.check_item(
+                kind, {k: v for k, v in item.items() if k != 'id'},
+                partial=True)
+        except schemas.ValidationError as err:
+            results[i] = item_error(err.error, id)
+            continue
+        if not item_changes:
+            results[i] = item_error(err_obj.MISS_ATTR_ALL_400, id)
+            continue
+        changes.setdefault(id, {}).update(item_changes)
+        pending.append((i, id))
+
+    def update_batch(batch):
+        # Read the entities again in the transaction, so the changes are
+        # applied to their current state and a retry sees a concurrent
+        # writer's changes
+        current = {entity.key.id: entity for entity in get_entities(
+            [client.key(kind, id) for id in batch])}
+        written = {}
+        refused = {}
+        for id in batch:
+            entity = current.get(id)
+            if entity is None:
+                refused[id] = not_found
+            elif owner is not None and entity['owner'] != owner:
+                refused[id] = forbidden
+            else:
+                entity.update(changes[id])
+                written[id] = entity
+        if written:
+            put_entities(list(written.values()))
+        return written, refused
+
+    updated = {}
+    refused = {}
+    for batch in batched(list(changes)):
+        written, batch_refused = run_transaction(update_batch, batch)
+        for id, entity in written.items():
+            record_change('update', kind, id, entity.get('owner'))
+        updated.update(written)
+        refused.update(batch_refused)
+
+    if kind == const.BOATS:
+        load_ids = carried_load_ids_multi(list(updated.values()))
+    for i, id in pending:
+        if id in refused:
+            results[i] = item_error(refused[id], id)
+            continue
+        entity = updated[id]
+        result = dict(entity, status=200)
+        if kind == const.BOATS:
+            result['loads'] = representation.load_refs(
+                load_ids[id], BASE_URL)
+        result['id'] = id
+        result['self'] = BASE_URL + '/' + kind + '/' + str(id)
+        results[i] = result
+    return results
+
+
+def delete_boats(items, owner):
+    """Delete every boat named in a batch that is owned by owner. Boats
+    without loads are removed with delete_multi, while boats carrying loads
+    go through delete_boat so their loads are unloaded. Whether a boat
+    carries loads is checked inside the transaction that deletes it, from
+    its 'loads' list in array mode or with IN queries on the loads'
+    'carrier' in carrier mode
+
+    Return a list of per-item results in the same order as items
+    """
+    results = [None] * len(items)
+    ids = [item_id(item) for item in items]
+    found = get_multi_by_id(const.BOATS, [id for id in ids if id is not None])
+
+    deleted = set()
+    candidates = []
+    for i, id in enumerate(ids):
+        boat = found.get(id)
+        if boat is None:
+            results[i] = item_error(err_obj.NO_BOAT_FOUND_404, id)
+        elif boat['owner'] != owner:
+            results[i] = item_error(err_obj.FBD_BOAT_DELETE_403, id)
+        else:
+            if id not in deleted:
+                deleted.add(id)
+                candidates.append(boat.key)
+            results[i] = {'status': 204, 'id': id}
+
+    def delete_if_empty(keys):
+        # Read the boats again in the transaction, which conflicts with any
+        # concurrent load put on them, and delete only those still empty.
+        # Putting a load on a boat in carrier mode only writes the load, so
+        # the loads are queried in the transaction too
+        boats = [boat for boat in get_entities(keys)
+                 if boat['owner'] == owner]
+        if LOADS_MODE == const.LOADS_CARRIER:
+            carriers = query_carrier_ids([boat.key.id for boat in boats])
+        empty = []
+        loaded = []
+        for boat in boats:
+            if LOADS_MODE == const.LOADS_CARRIER:
+                has_loads = boat.key.id in carriers
+            else:
+                has_loads = bool(boat['loads'])
+            if has_loads:
+                loaded.append(boat)
+            else:
+                empty.append(boat.key)
+        if empty:
+            delete_entities(empty)
+        return empty, loaded
+
+    for batch in batched(candidates):
+        empty, loaded = run_transaction(delete_if_empty, batch)
+        for key in empty:
+            record_change('delete', const.BOATS, key.id, owner)
+        for boat in loaded:
+            delete_boat(boat)
+    return results
+
+
+def delete_loads(items):
+    """Delete every load named in a batch. In array mode, boats carrying
+    any of the loads are read with get_multi and have the loads removed from
+    their 'loads' list in the same transaction that deletes the loads
+
+    Return a list of per-item results in the same order as items
+    """
+    results = [None] * len(items)
+    ids = [item_id(item) for item in items]
+    found = get_multi_by_id(const.LOADS, [id for id in ids if id is not None])
+
+    for i, id in enumerate(ids):
+        if id not in found:
+            results[i] = item_error(err_obj.NO_LOAD_FOUND_404, id)
+        else:
+            results[i] = {'status': 204, 'id': id}
+
+    loads = list(found.values())
+    if LOADS_MODE == const.LOADS_CARRIER:
+        # No boat refers to its loads, so only the loads are deleted
+        for batch in batched([load.key for load in loads]):
+            delete_entities(batch)
+            for key in batch:
+                record_change('delete', const.LOADS, key.id)
+        return results
+
+    def unload_and_delete(keys):
+        # Read the loads again in the transaction, so a retry sees the boats
+        # they were moved to in the meantime
+        batch = get_entities(keys)
+        carrier_ids = set(load['carrier'] for load in batch
+                          if load['carrier'] is not None)
+        boats = get_multi_by_id(const.BOATS, list(carrier_ids))
+        for load in batch:
+            boat = boats.get(load['carrier'])
+            if boat is not None and load.key.id in boat['loads']:
+                boat['loads'].remove(load.key.id)
+        if boats:
+            put_entities(list(boats.values()))
+        delete_entities(keys)
+        return batch
+
+    # A load and the boat carrying it take two entities of a commit
+    for batch in batched(loads, const.MAX_COMMIT_ENTITIES // 2):
+        deleted = run_transaction(unload_and_delete,
+                                  [load.key for load in batch])
+        for load in deleted:
+            record_change('delete', const.LOADS, load.key.id,
+                          boat_id=load['carrier'])
+    return results
+
+
+def add_query_args(query, kind, equalities=(), fields=None):
+    """Add the filters and sort order in the request args to a collection
+    query, if index.yaml declares an index that can serve them. If only
+    some fields are needed, the query becomes a keys-only or projection
+    query when an index can serve that too
+
+    Return an error response, or None if the query can run
+    """
+    try:
+        filters, orders = query_filters.parse(kind, request.args)
+        orders = query_filters.plan(kind, filters, orders, INDEXES,
+                                    equalities)
+    except query_filters.QueryError as err:
+        return get_resp(err.error['msg'], err.error['status'])
+    query_filters.apply(query, filters, orders)
+    projection = fieldsets.projection(kind, fields, filters, orders, INDEXES,
+                                      equalities)
+    if projection == []:
+        query.keys_only()
+    elif projection:
+        query.projection = projection
+    return None
+
+
+def aggregate(query, sum_of=None):
+    """Count the entities matched by a query, and total one of their
+    numeric attributes if sum_of is given, with a datastore aggregation
+    query so no entities are read
+
+    Return a dictionary with 'count' and, if requested, 'sum'
+    """
+    agg_query = client.aggregation_query(query).count(alias='count')
+    if sum_of is not None:
+        agg_query.sum(sum_of, alias='sum')
+    values = {'count': 0}
+    if sum_of is not None:
+        values['sum'] = 0
+    with metrics.timed('ds_aggregate'):
+        for batch in agg_query.fetch():
+            for result in batch:
+                values[result.alias] = result.value
+    return values
+
+
+def cached_aggregate(kind, scope, query, sum_of=None):
+    """Run aggregate() through the count cache. scope identifies whatever
+    the query is limited to, such as an owner or a boat, and is combined
+    with the request's filter args to form the cache key
+    """
+    args = tuple(sorted((k, v) for k, v in request.args.items(multi=True)
+                        if k in query_filters.FIELDS[kind]
+                        or k.partition('.')[0] in query_filters.FIELDS[kind]))
+    key = (scope, sum_of, args)
+    values = count_store.get(kind, key)
+    if values is None:
+        values = aggregate(query, sum_of)
+        count_store.set(kind, key, values)
+    return values
+
+
+def wants_total():
+    """Return True if a list request asks for 'total_items'"""
+    return request.args.get('include_total', '').lower() in ('1', 'true')
+
+
+def fetch_page(query, path):
+    """Fetch one page of query results for a collection route
+
+    Pages are addressed by an opaque 'cursor' request arg built from the
+    datastore next_page_token. Requests that send an 'offset' arg instead
+    are served through the older offset scan so existing clients keep
+    working, and are reported with the 'offset' pagination mode.
+
+    Return a tuple of (entity list, next url or None, pagination mode). The
+    entity list is None if the cursor could not be used
+    """
+    q_limit = int(request.args.get('limit', '5'))
+    cursor = request.args.get('cursor')
+    # Filters and sort order carry over to the next page
+    carried = urlencode([(k, v) for k, v in request.args.items(multi=True)
+                         if k not in const.PAGE_ARGS])
+    if carried:
+        path = path + '?' + carried + '&'
+    else:
+        path = path + '?'
+
+    if cursor is None and 'offset' in request.args:
+        q_offset = int(request.args.get('offset', '0'))
+        with metrics.timed('ds_query'):
+            g_iterator = query.fetch(limit=q_limit, offset=q_offset)
+            page = list(next(g_iterator.pages))
+
+        # If there is another page, set next url using limit and offset
+        next_url = None
+        if g_iterator.next_page_token:
+            next_offset = q_offset + q_limit
+            next_url = BASE_URL + path + 'limit=' + str(
+                q_limit) + '&offset=' + str(next_offset)
+        return page, next_url, const.PAGE_OFFSET
+
+    try:
+        with metrics.timed('ds_query'):
+            g_iterator = query.fetch(limit=q_limit, start_cursor=cursor)
+            page = list(next(g_iterator.pages))
+    except (ValueError, BadRequest):
+        return None, None, const.PAGE_CURSOR
+
+    # If there is another page, set next url using limit and cursor
+    next_url = None
+    token = g_iterator.next_page_token
+    if token:
+        if isinstance(token, bytes):
+            token = token.decode('ascii')
+        next_url = BASE_URL + path + 'limit=' + str(
+            q_limit) + '&cursor=' + quote_plus(token)
+    return page, next_url, const.PAGE_CURSOR
 
 
 # Format error response and append status code
@@ -152,30 +1196,26 @@ def get_token_auth_header(req):
     auth = req.headers.get('Authorization', None)
     if not auth:
         results.err = get_auth_error_resp(
-            AuthError({'code': 'authorization_header_missing',
-                       'description':
-                       'Authorization header is expected'}, 401))
+            AuthError(err_obj.AUTH_HEADER_MISSING_401['msg'],
+                      err_obj.AUTH_HEADER_MISSING_401['status']))
         return results
 
     parts = auth.split()
 
     if parts[0].lower() != 'bearer':
         results.err = get_auth_error_resp(
-            AuthError({'code': 'invalid_header',
-                       'description':
-                       'Authorization header must start with Bearer'}, 401))
+            AuthError(err_obj.AUTH_NOT_BEARER_401['msg'],
+                      err_obj.AUTH_NOT_BEARER_401['status']))
         return results
     elif len(parts) == 1:
         results.err = get_auth_error_resp(
-            AuthError({'code': 'invalid_header',
-                       'description':
-                       'Token not found'}, 401))
+            AuthError(err_obj.AUTH_NO_TOKEN_401['msg'],
+                      err_obj.AUTH_NO_TOKEN_401['status']))
         return results
     elif len(parts) > 2:
         results.err = get_auth_error_resp(
-            AuthError({"code": "invalid_header",
-                       "description":
-                       "Authorization header must be Bearer token"}, 401))
+            AuthError(err_obj.AUTH_NOT_BEARER_TOKEN_401['msg'],
+                      err_obj.AUTH_NOT_BEARER_TOKEN_401['status']))
         return results
 
     results.token = parts[1]
@@ -188,78 +1228,282 @@ def verify_jwt(req):
     results = get_token_auth_header(req)
     if results.err is not None:
         return results
-    jsonurl = urlopen('https://'+AUTH0_DOMAIN+'/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+
+    payload = token_store.get(results.token)
+    if payload is not None:
+        _request_ctx_stack.top.current_user = payload
+        results.payload = payload
+        return results
+
     try:
         unverified_header = jwt.get_unverified_header(results.token)
     except jwt.JWTError:
         results.err = get_auth_error_resp(
-            AuthError({"code": "invalid_header",
-                       "description":
-                       'Invalid header.'
-                       ' Use an RS256 signed JWT Access Token'}, 401))
+            AuthError(err_obj.AUTH_NOT_RS256_401['msg'],
+                      err_obj.AUTH_NOT_RS256_401['status']))
         return results
 
     if unverified_header["alg"] == "HS256":
         results.err = get_auth_error_resp(
-            AuthError({"code": "invalid_header",
-                       "description":
-                       "Invalid header."
-                       " Use an RS256 signed JWT Access Token"}, 401))
+            AuthError(err_obj.AUTH_NOT_RS256_401['msg'],
+                      err_obj.AUTH_NOT_RS256_401['status']))
         return results
 
-    rsa_key = {}
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header.get('kid'))
     if rsa_key:
         try:
-            payload = jwt.decode(
-                results.token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=AUTH0_CLIENT_ID,
-                issuer='https://'+AUTH0_DOMAIN+'/'
-            )
+            with metrics.timed('jwt'):
+                payload = jwt.decode(
+                    results.token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=AUTH0_CLIENT_ID,
+                    issuer='https://'+AUTH0_DOMAIN+'/'
+                )
         except jwt.ExpiredSignatureError:
             results.err = get_auth_error_resp(
-                AuthError({'code': 'token_expired',
-                           'description':
-                           'token is expired'}, 401))
+                AuthError(err_obj.AUTH_TOKEN_EXPIRED_401['msg'],
+                          err_obj.AUTH_TOKEN_EXPIRED_401['status']))
             return results
 
         except jwt.JWTClaimsError:
             results.err = get_auth_error_resp(
-                AuthError({'code': 'invalid_claims',
-                           'description':
-                           'incorrect claims,'
-                           ' please check the audience and issuer'}, 401))
+                AuthError(err_obj.AUTH_INVALID_CLAIMS_401['msg'],
+                          err_obj.AUTH_INVALID_CLAIMS_401['status']))
             return results
 
         except Exception:
             results.err = get_auth_error_resp(
-                AuthError({'code': 'invalid_header',
-                           'description':
-                           'Unable to parse authentication token.'}, 401))
+                AuthError(err_obj.AUTH_UNPARSABLE_TOKEN_401['msg'],
+                          err_obj.AUTH_UNPARSABLE_TOKEN_401['status']))
             return results
 
+        token_store.put(results.token, payload)
         _request_ctx_stack.top.current_user = payload
         results.payload = payload
         return results
     else:
         results.err = get_auth_error_resp(
-            AuthError({'code': 'invalid_header',
-                       'description':
-                       'Unable to find appropriate key'}, 401))
+            AuthError(err_obj.AUTH_NO_KEY_401['msg'],
+                      err_obj.AUTH_NO_KEY_401['status']))
         return results
 
 
+@app.before_request
+def start_timing():
+    metrics.start_request()
+
+
+@app.after_request
+def finish_timing(response):
+    return metrics.finish_request(metrics.route_label(), request.method,
+                                  response)
+
+
+@app.after_request
+def compress_response(response):
+    """Compress the response body as negotiated with the client. This runs
+    after every other after_request hook but finish_timing, so stored
+    idempotent responses are kept uncompressed
+    """
+    if compressor is None:
+        return response
+    with metrics.timed('compress'):
+        return compressor.apply(response, request.accept_encodings)
+
+
+def client_address():
+    """Return the address of the client, taken from X-Forwarded-For as set
+    by the TRUSTED_PROXIES closest to the app
+    """
+    forwarded = request.headers.get('X-Forwarded-For')
+    if TRUSTED_PROXIES and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        if len(hops) >= TRUSTED_PROXIES:
+            return hops[-TRUSTED_PROXIES]
+    return request.remote_addr
+
+
+def token_subject():
+    """Return the subject of the request's bearer token if it was verified
+    already and is still cached, or else None. An unverified token can claim
+    any subject, so it can't pick the bucket its request is charged to
+    """
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        return None
+    payload = token_store.peek(parts[1])
+    return payload.get('sub') if payload is not None else None
+
+
+def get_admission_error_resp(error, wait):
+    """Create a 429 or 503 response telling the client when to retry"""
+    response = get_resp(error['msg'], error['status'])
+    response.headers['Retry-After'] = admission.retry_after(wait)
+    return response
+
+
+@app.before_request
+def admit_request():
+    """Turn away requests over the caller's rate limit or beyond the cap on
+    requests in flight, before their tokens are verified
+    """
+    if request.endpoint in ADMISSION_EXEMPT:
+        return None
+    subject = token_subject()
+    if subject is not None:
+        wait = admission_control.limit('subject', subject)
+    else:
+        wait = admission_control.limit('ip', client_address())
+    if wait:
+        return get_admission_error_resp(err_obj.TOO_MANY_REQUESTS_429, wait)
+    if not admission_control.enter():
+        return get_admission_error_resp(err_obj.OVERLOADED_503, 1)
+    g.admitted = True
+    return None
+
+
+@app.after_request
+def hold_streamed_request(response):
+    """Keep a streamed response counted as in flight until it has been
+    sent, rather than only until the view returns
+    """
+    if response.is_streamed and g.pop('admitted', False):
+        response.call_on_close(admission_control.leave)
+    return response
+
+
+@app.teardown_request
+def release_request(exc):
+    if g.pop('admitted', False):
+        admission_control.leave()
+
+
+@app.before_request
+def replay_idempotent():
+    """Answer a write request sent again with the same Idempotency-Key
+    header with the response to the first one, so the write is not applied
+    twice
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key is None or request.method not in const.WRITE_METHODS:
+        return None
+    caller = request.headers.get('Authorization') or request.remote_addr
+    store_key = hashlib.sha256(
+        '\n'.join([str(caller), key]).encode('utf-8')).hexdigest()
+    fingerprint = hashlib.sha256(
+        request.method.encode('utf-8') + b' '
+        + request.full_path.encode('utf-8') + b'\n'
+        + request.get_data()).hexdigest()
+
+    record = idempotency_store.begin(store_key)
+    if record is None:
+        g.idempotency = (store_key, fingerprint)
+        return None
+    if record == idempotency.IN_PROGRESS:
+        return get_resp(err_obj.IDEMPOTENCY_IN_PROGRESS_409['msg'],
+                        err_obj.IDEMPOTENCY_IN_PROGRESS_409['status'])
+    if record['fingerprint'] != fingerprint:
+        return get_resp(err_obj.IDEMPOTENCY_KEY_REUSED_422['msg'],
+                        err_obj.IDEMPOTENCY_KEY_REUSED_422['status'])
+    response = make_response(record['body'], record['status'])
+    response.mimetype = record['mimetype']
+    response.headers.update(record['headers'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+@app.after_request
+def store_idempotent(response):
+    """Keep the response to a write sent with an Idempotency-Key header.
+    Responses that ask the client to try again are not kept
+    """
+    claim = g.pop('idempotency', None)
+    if claim is None:
+        return response
+    store_key, fingerprint = claim
+    if response.status_code >= 500 or response.status_code in (409, 429) \
+            or response.is_streamed:
+        idempotency_store.abandon(store_key)
+    else:
+        idempotency_store.finish(store_key, fingerprint, response)
+    return response
+
+
+@app.after_request
+def publish_changes(response):
+    """Store the change records of the writes made by the request in the
+    change log, and queue them for the webhook
+    """
+    records = g.pop('changes', None)
+    if not records:
+        return response
+    with metrics.timed('changes'):
+        change_log.append(records)
+    if webhook_sender is not None:
+        webhook_sender.enqueue([changelog.public(r) for r in records])
+    return response
+
+
+@app.errorhandler(Conflict)
+def transaction_conflict(err):
+    """Answer a request whose transaction still conflicted with concurrent
+    writes after every retry
+    """
+    response = get_resp(err_obj.TXN_CONFLICT_409['msg'],
+                        err_obj.TXN_CONFLICT_409['status'])
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@app.route('/metrics')
+def metrics_get():
+    """Expose request, phase and cache metrics in the Prometheus text
+    format to callers with the METRICS_TOKEN. Every number is counted by
+    the worker process that serves the request, so a scraper sees one
+    process at a time and must sum them across workers and instances
+    """
+    expected = 'Bearer ' + (METRICS_TOKEN or '')
+    if not METRICS_TOKEN or not hmac.compare_digest(
+            request.headers.get('Authorization', '').encode('utf-8'),
+            expected.encode('utf-8')):
+        return get_resp(err_obj.AUTH_METRICS_TOKEN_401['msg'],
+                        err_obj.AUTH_METRICS_TOKEN_401['status'])
+
+    lines = []
+    lines += metrics.counter_lines(
+        'app_jwks_cache_total', 'JWKS key store counters', 'event',
+        {k: v for k, v in jwks_store.stats().items() if k != 'keys'})
+    lines += metrics.counter_lines(
+        'app_token_cache_total', 'Verified token cache counters', 'event',
+        {k: v for k, v in token_store.stats().items() if k != 'hit_rate'})
+    lines += metrics.counter_lines(
+        'app_admission_rejections_total',
+        'Requests turned away by rate limit scope or in-flight cap',
+        'reason', dict(admission_control.rejections, change_waiters=(
+            change_waiters.rejections.get('in_flight', 0))))
+    lines += metrics.counter_lines(
+        'app_change_records_total', 'Change log records stored or lost',
+        'event', change_log.stats())
+    lines += metrics.counter_lines(
+        'app_idempotency_responses_total',
+        'Idempotent responses that could not be stored', 'event',
+        {'store_failed': idempotency_store.failed})
+    if webhook_sender is not None:
+        lines += metrics.counter_lines(
+            'app_webhook_records_total', 'Webhook delivery counters',
+            'event', webhook_sender.stats())
+    lines += metrics.counter_lines(
+        'app_entity_cache_hits_total', 'Entity cache hits by kind', 'kind',
+        entity_store.hits)
+    lines += metrics.counter_lines(
+        'app_entity_cache_misses_total', 'Entity cache misses by kind',
+        'kind', entity_store.misses)
+    response = make_response(metrics.registry.render(lines))
+    response.mimetype = const.TEXT_PLAIN
+    return response
+
+
 @app.route('/login')
 def login():
     return oauth.auth0.authorize_redirect(
@@ -315,10 +1559,24 @@ def users_get():
 
     if request.method == 'GET':
         query = client.query(kind=const.USERS)
-        users = list(query.fetch())
-        for user in users:
-            user['id'] = user.key.id_or_name
-        return get_resp(users, 200)
+
+        # Without pagination args, stream every user as a JSON array
+        if not any(arg in request.args for arg in const.PAGE_ARGS):
+            return get_stream_resp(representation.stream_array(
+                query.fetch(), encode_user))
+
+        # Get a page of at most 'limit' (default 5) users from datastore
+        users, next_url, pagination = fetch_page(query, '/users')
+        if users is None:
+            return get_resp(err_obj.BAD_CURSOR_400['msg'],
+                            err_obj.BAD_CURSOR_400['status'])
+
+        # Add pagination mode and next url, if not None, to the users list
+        extra = {'pagination': pagination}
+        if next_url:
+            extra['next'] = next_url
+        return get_json_resp(representation.page_json(
+            'users', users, encode_user, extra), 200)
 
     else:
         return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
@@ -339,65 +1597,170 @@ def boats_post_get():
             return get_resp(err_obj.WRONG_TYPE_415['msg'],
                             err_obj.WRONG_TYPE_415['status'])
 
-        if len(request.get_json()) < 3:
-            return get_resp(err_obj.MISS_ATTR_ONE_400['msg'],
-                            err_obj.MISS_ATTR_ONE_400['status'])
+        try:
+            content = schemas.validate(const.BOATS, request)
+        except schemas.ValidationError as err:
+            return get_resp(err.error['msg'], err.error['status'])
 
         results = verify_jwt(request)
         if results.err is not None:
             return results.err
-        content = request.get_json()
         new_boat = create_entity(
             const.BOATS,
-            {'name': content['name'],
-             'type': content['type'],
-             'length': content['length'],
-             'owner': results.payload['sub'],
-             'loads': []})
+            dict(content, **new_boat_attrs(results.payload['sub'])))
+        record_change('create', const.BOATS, new_boat.key.id,
+                      new_boat['owner'])
+        new_boat.setdefault('loads', [])
         new_boat['id'] = new_boat.key.id
         new_boat['self'] = BASE_URL + '/boats/' + str(new_boat.key.id)
         return get_resp(new_boat, 201)
 
     elif request.method == 'GET':
+        try:
+            fields, embed = fieldsets.parse(const.BOATS, request.args)
+        except fieldsets.FieldsetError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+
+        results = verify_jwt(request)
+        if results.err is not None:
+            return results.err
+
         query = client.query(kind=const.BOATS)
+        query.add_filter('owner', '=', results.payload['sub'])
+        err = add_query_args(query, const.BOATS, ['owner'], fields)
+        if err is not None:
+            return err
+        if wants_stream():
+            return get_stream_resp(representation.stream_array(
+                query.fetch(),
+                lambda boat: boat_encoder([boat], fields, embed)(boat),
+                '{"boats":[', ']}'))
+
+        # Get a page of at most 'limit' (default 5) boats from datastore
+        boats, next_url, pagination = fetch_page(query, '/boats')
+        if boats is None:
+            return get_resp(err_obj.BAD_CURSOR_400['msg'],
+                            err_obj.BAD_CURSOR_400['status'])
+
+        # Add pagination mode and next url, if not None, to the boats list
+        extra = {'pagination': pagination}
+        if next_url:
+            extra['next'] = next_url
+        if wants_total():
+            extra['total_items'] = cached_aggregate(
+                const.BOATS, results.payload['sub'], query)['count']
+
+        # Boats are encoded with 'id', 'self', and load references directly
+        # from their stored attributes and load IDs
+        return get_json_resp(
+            representation.page_json(
+                'boats', boats, boat_encoder(boats, fields, embed), extra),
+            200)
+
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
+
+
+@app.route('/boats/count', methods=const.METHODS)
+def boats_count():
+    """Count the user's boats that match the filters in the request args"""
+    if const.APP_JSON not in request.accept_mimetypes:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method == 'GET':
         results = verify_jwt(request)
         if results.err is not None:
             return results.err
 
-        q_limit = int(request.args.get('limit', '5'))
-        q_offset = int(request.args.get('offset', '0'))
         query = client.query(kind=const.BOATS)
         query.add_filter('owner', '=', results.payload['sub'])
-        # Get a list of at most 5 boats from datastore
-        g_iterator = query.fetch(limit=q_limit, offset=q_offset)
-        pages = g_iterator.pages
-        boats = list(next(pages))
+        err = add_query_args(query, const.BOATS, ['owner'])
+        if err is not None:
+            return err
+        values = cached_aggregate(const.BOATS, results.payload['sub'], query)
+        return get_resp({'count': values['count']}, 200)
 
-        # If there is another page, set next url using limit and offset
-        next_url = None
-        if g_iterator.next_page_token:
-            next_offset = q_offset + q_limit
-            next_url = BASE_URL + '/boats' + '?limit=' + str(
-                q_limit) + '&offset=' + str(next_offset)
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
 
-        # Add 'id', 'self', and convert loads list for each boat object
-        for boat in boats:
-            boat['id'] = boat.key.id
-            # Convert any loads from ID value to dict with 'id', 'self'
-            if len(boat['loads']) > 0:
-                loads = construct_loads(boat['loads'])
-                boat['loads'] = loads
-            boat['self'] = BASE_URL + '/boats/' + str(boat.key.id)
-
-        # Add list to dict
-        resp_body = {'boats': boats}
-        # Add next url to dict if not None
-        if next_url:
-            print("next url detected")
 
-            resp_body['next'] = next_url
+@app.route('/boats/aggregate', methods=const.METHODS)
+def boats_aggregate():
+    """Total the boats of the user and the count and volume of the loads on
+    them
+    """
+    if const.APP_JSON not in request.accept_mimetypes:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method == 'GET':
+        results = verify_jwt(request)
+        if results.err is not None:
+            return results.err
+        owner = results.payload['sub']
+
+        values = count_store.get(const.BOATS_AGGREGATE, owner)
+        if values is None:
+            query = client.query(kind=const.BOATS)
+            query.add_filter('owner', '=', owner)
+            query.keys_only()
+            with metrics.timed('ds_query'):
+                boat_ids = [boat.key.id for boat in query.fetch()]
+
+            values = {'boat_count': len(boat_ids), 'load_count': 0,
+                      'total_volume': 0}
+            # An IN filter takes at most const.MAX_IN_VALUES values
+            for batch in batched(boat_ids, const.MAX_IN_VALUES):
+                query = client.query(kind=const.LOADS)
+                query.add_filter('carrier', 'IN', batch)
+                totals = aggregate(query, 'volume')
+                values['load_count'] += totals['count']
+                values['total_volume'] += totals['sum']
+            count_store.set(const.BOATS_AGGREGATE, owner, values)
+
+        return get_resp(dict(values, owner=owner), 200)
+
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
+
+
+@app.route('/boats/<boat_id>/aggregate', methods=const.METHODS)
+def boat_aggregate(boat_id):
+    """Total the count and volume of the loads on one of the user's boats"""
+    if const.APP_JSON not in request.accept_mimetypes:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method == 'GET':
+        # Verify the JWT while the boat is read
+        results, boat = io_pool.gather(
+            lambda: verify_jwt(request),
+            lambda: get_entity(const.BOATS, int(boat_id)))
+        if results.err is not None:
+            return results.err
+
+        if boat is None:
+            return get_resp(err_obj.NO_BOAT_FOUND_404['msg'],
+                            err_obj.NO_BOAT_FOUND_404['status'])
+
+        if results.payload['sub'] != boat['owner']:
+            return get_resp(err_obj.FBD_BOAT_READ_403['msg'],
+                            err_obj.FBD_BOAT_READ_403['status'])
 
-        return get_resp(resp_body, 200)
+        query = client.query(kind=const.LOADS)
+        query.add_filter('carrier', '=', boat.key.id)
+        totals = cached_aggregate(const.LOADS, boat.key.id, query, 'volume')
+        return get_resp({'id': boat.key.id,
+                         'self': BASE_URL + '/boats/' + str(boat.key.id),
+                         'load_count': totals['count'],
+                         'total_volume': totals['sum']}, 200)
 
     else:
         return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
@@ -414,10 +1777,32 @@ def boat_del_get_put_patch(id):
 
     if request.method != 'POST':
 
-        results = verify_jwt(request)
+        # Check the body before any authentication or datastore work
+        if request.method == 'PATCH' or request.method == 'PUT':
+            if request.mimetype != const.APP_JSON:
+                return get_resp(err_obj.WRONG_TYPE_415['msg'],
+                                err_obj.WRONG_TYPE_415['status'])
+            try:
+                content = schemas.validate(const.BOATS, request,
+                                           partial=request.method == 'PATCH')
+            except schemas.ValidationError as err:
+                return get_resp(err.error['msg'], err.error['status'])
+
+        try:
+            fields, embed = fieldsets.parse(const.BOATS, request.args)
+        except fieldsets.FieldsetError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+
+        # Verify the JWT while the boat is read. In carrier mode the boat's
+        # loads are looked up at the same time, before the transaction below
+        calls = [lambda: verify_jwt(request),
+                 lambda: get_entity(const.BOATS, int(id))]
+        if LOADS_MODE == const.LOADS_CARRIER and request.method != 'DELETE':
+            calls.append(lambda: query_load_ids(int(id)))
+        results, boat, *queried = io_pool.gather(*calls)
+        load_ids = queried[0] if queried else None
         if results.err is not None:
             return results.err
-        boat = get_entity(const.BOATS, int(id))
 
         if boat is None:
             return get_resp(err_obj.NO_BOAT_FOUND_404['msg'],
@@ -434,52 +1819,50 @@ def boat_del_get_put_patch(id):
                 return get_resp(err_obj.FBD_BOAT_UPDATE_403['msg'],
                                 err_obj.FBD_BOAT_UPDATE_403['status'])
 
+        # A PATCH body may hold only attributes the schema leaves out
+        if request.method == 'PATCH' and not content:
+            return get_resp(err_obj.MISS_ATTR_ALL_400['msg'],
+                            err_obj.MISS_ATTR_ALL_400['status'])
+
         if request.method == 'DELETE':
-            query = client.query(kind=const.LOADS)
-            query.add_filter('carrier', '=', int(id))
-            loads = list(query.fetch())
-            for i in range(len(loads)):
-                with client.transaction():
-                    loads[i]['carrier'] = None
-                    client.put(loads[i])
-
-            client.delete(boat)
+            delete_boat(boat)
             return get_resp(None, 204)
 
-        elif request.method == 'PATCH':
-            if request.mimetype != const.APP_JSON:
-                return get_resp(err_obj.WRONG_TYPE_415['msg'],
-                                err_obj.WRONG_TYPE_415['status'])
-            keys = request.get_json().keys()
-            if len(keys) < 1:
-                return get_resp(err_obj.MISS_ATTR_ALL_400['msg'],
-                                err_obj.MISS_ATTR_ALL_400['status'])
-            with client.transaction():
-                for key in keys:
-                    boat[key] = request.get_json()[key]
-                client.put(boat)
-
-        elif request.method == 'PUT':
-            if request.mimetype != const.APP_JSON:
-                return get_resp(err_obj.WRONG_TYPE_415['msg'],
-                                err_obj.WRONG_TYPE_415['status'])
-            body = request.get_json()
-            if len(body) < 3:
-                return get_resp(err_obj.MISS_ATTR_ONE_400['msg'],
-                                err_obj.MISS_ATTR_ONE_400['status'])
-            with client.transaction():
-                boat['name'] = body['name']
-                boat['type'] = body['type']
-                boat['length'] = body['length']
-                client.put(boat)
+        elif request.method == 'PATCH' or request.method == 'PUT':
+            # PATCH and PUT differ only in the schema check above
+            def update_boat():
+                boat = get_entity(const.BOATS, int(id))
+                # It may have been deleted since it was read above
+                if boat is None:
+                    return None, err_obj.NO_BOAT_FOUND_404
+                if not etag_matches(boat, load_ids):
+                    return None, err_obj.PRECONDITION_FAILED_412
+                boat.update(content)
+                put_entity(boat)
+                return boat, None
+            boat, err = run_transaction(update_boat)
+            if err is not None:
+                return get_resp(err['msg'], err['status'])
+            record_change('update', const.BOATS, boat.key.id, boat['owner'])
 
         # Same block for 'GET', 'PATCH', and 'PUT'
-        if len(boat['loads']) > 0:
-            loads = construct_loads(boat['loads'])
-            boat['loads'] = loads
-        boat['id'] = boat.key.id
-        boat['self'] = BASE_URL + '/boats/' + str(boat.key.id)
-        return get_resp(boat, 200)
+        if load_ids is None:
+            load_ids = carried_load_ids(boat)
+        etag = boat_etag(boat, load_ids)
+        loads = None
+        if 'loads' in embed:
+            loads = ordered_loads(get_multi_by_id(const.LOADS, load_ids),
+                                  load_ids)
+            # Embedded loads are part of the response, so a change to one
+            # must change its ETag
+            etag = entity_etag(dict(boat, loads=[
+                dict(load, id=load.key.id) for load in loads]))
+        matched = compression.matching_etag(etag, request.if_none_match)
+        if request.method == 'GET' and matched is not None:
+            return get_not_modified_resp(matched)
+        return get_json_resp(
+            representation.boat_json(boat, BASE_URL, load_ids, fields,
+                                     loads), 200, etag=etag)
 
     else:
         return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
@@ -491,13 +1874,16 @@ def boats_put_remove_load(boat_id, load_id):
     """"""
     if request.method == 'PUT' or request.method == 'DELETE':
 
-        results = verify_jwt(request)
+        # Verify the JWT while the boat and load are read in one lookup
+        boat_key = client.key(const.BOATS, int(boat_id))
+        load_key = client.key(const.LOADS, int(load_id))
+        results, found = io_pool.gather(
+            lambda: verify_jwt(request),
+            lambda: get_entities([boat_key, load_key]))
         if results.err is not None:
             return results.err
 
-        boat = get_entity(const.BOATS, int(boat_id))
-        load = get_entity(const.LOADS, int(load_id))
-
+        boat, load = split_boat_load(found, boat_key)
         if boat is None or load is None:
             return get_resp(err_obj.NO_BOAT_LOAD_FOUND_404['msg'],
                             err_obj.NO_BOAT_LOAD_FOUND_404['status'])
@@ -511,31 +1897,58 @@ def boats_put_remove_load(boat_id, load_id):
                                 err_obj.FBD_ADD_USER_BOAT_403['status'])
 
         if request.method == 'PUT':
-            if load['carrier'] is not None:
-                if int(load['carrier']) != int(boat.key.id):
-                    return get_resp(err_obj.FBD_LOAD_LOADED_403['msg'],
-                                    err_obj.FBD_LOAD_LOADED_403['status'])
-                elif int(load.key.id) in boat['loads']:
-                    return get_resp(err_obj.FBD_LOAD_LOADED_403['msg'],
-                                    err_obj.FBD_LOAD_LOADED_403['status'])
-
-            with client.transaction():
-                boat['loads'].append(int(load_id))
+            err = put_load_error(boat, load)
+            if err is not None:
+                return get_resp(err['msg'], err['status'])
+
+            def put_load_on_boat():
+                # Check again with the boat and load read in the transaction
+                boat, load = split_boat_load(
+                    get_entities([boat_key, load_key]), boat_key)
+                if boat is None or load is None:
+                    return err_obj.NO_BOAT_LOAD_FOUND_404
+                err = put_load_error(boat, load)
+                if err is not None:
+                    return err
+                if LOADS_MODE == const.LOADS_ARRAY:
+                    boat['loads'].append(int(load_id))
+                    put_entity(boat)
                 load['carrier'] = int(boat.key.id)
-                client.put(boat)
-                client.put(load)
+                put_entity(load)
+                return None
+            err = run_transaction(put_load_on_boat)
+            if err is not None:
+                return get_resp(err['msg'], err['status'])
+            record_change('assign', const.LOADS, load_id, boat['owner'],
+                          boat_id)
             return get_resp(None, 204)
 
         elif request.method == 'DELETE':
             if load['carrier'] != boat.key.id:
                 return get_resp(err_obj.FBD_LOAD_DIFF_403['msg'],
                                 err_obj.FBD_LOAD_DIFF_403['status'])
-        # Update boat's loads and load's carrier value and put on datastore
-            with client.transaction():
-                boat['loads'].remove(int(load.key.id))
+
+            # Update boat's loads and load's carrier value and put on
+            # datastore
+            def remove_load_from_boat():
+                boat, load = split_boat_load(
+                    get_entities([boat_key, load_key]), boat_key)
+                if boat is None or load is None:
+                    return err_obj.NO_BOAT_LOAD_FOUND_404
+                if load['carrier'] != boat.key.id:
+                    return err_obj.FBD_LOAD_DIFF_403
+                if LOADS_MODE == const.LOADS_ARRAY and \
+                        int(load.key.id) in boat['loads']:
+                    boat['loads'].remove(int(load.key.id))
+                    put_entity(boat)
                 load['carrier'] = None
-                client.put(boat)
-                client.put(load)
+                put_entity(load)
+                return None
+            err = run_transaction(remove_load_from_boat)
+            if err is not None:
+                return get_resp(err['msg'], err['status'])
+            record_change('remove', const.LOADS, load_id, boat['owner'],
+                          boat_id)
             return get_resp(None, 204)
 
     else:
@@ -543,6 +1956,108 @@ def boats_put_remove_load(boat_id, load_id):
                         err_obj.DISALLOWED_METHOD_405['status'])
 
 
+@app.route('/boats/<boat_id>/loads', methods=const.METHODS)
+def boats_put_loads(boat_id):
+    """Put every load in a JSON array of load IDs on a boat. The loads are
+    read with one get_multi once the caller is known to own the boat, and
+    written in a single transaction. Nothing is written unless every load
+    exists and is not already on a boat.
+
+    An array too large for one commit is written in one transaction per
+    batch. If a later batch fails, the loads of the batches before it stay
+    on the boat
+    """
+    if request.method == 'PUT':
+
+        if request.mimetype != const.APP_JSON:
+            return get_resp(err_obj.WRONG_TYPE_415['msg'],
+                            err_obj.WRONG_TYPE_415['status'])
+
+        try:
+            items = schemas.parse_body(request)
+        except schemas.ValidationError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+        err = check_batch(items)
+        if err is not None:
+            return err
+        load_ids = [item_id(item) for item in items]
+        if None in load_ids or item_id(boat_id) is None:
+            return get_resp(err_obj.INVALID_ID_400['msg'],
+                            err_obj.INVALID_ID_400['status'])
+        # Drop repeated IDs but keep the order they were sent in
+        load_ids = list(dict.fromkeys(load_ids))
+
+        # Verify the JWT while the boat is read. The loads, up to a whole
+        # batch of them, are only read once the caller may change the boat
+        boat_key = client.key(const.BOATS, int(boat_id))
+        results, boat = io_pool.gather(
+            lambda: verify_jwt(request),
+            lambda: get_entity(const.BOATS, int(boat_id)))
+        if results.err is not None:
+            return results.err
+
+        if boat is None:
+            return get_resp(err_obj.NO_BOAT_LOAD_FOUND_404['msg'],
+                            err_obj.NO_BOAT_LOAD_FOUND_404['status'])
+
+        if results.payload['sub'] != boat['owner']:
+            return get_resp(err_obj.FBD_ADD_USER_BOAT_403['msg'],
+                            err_obj.FBD_ADD_USER_BOAT_403['status'])
+
+        loads = get_entities([client.key(const.LOADS, id)
+                              for id in load_ids])
+        if len(loads) != len(load_ids):
+            return get_resp(err_obj.NO_BOAT_LOAD_FOUND_404['msg'],
+                            err_obj.NO_BOAT_LOAD_FOUND_404['status'])
+
+        for load in loads:
+            if load['carrier'] is not None:
+                return get_resp(err_obj.FBD_LOAD_LOADED_403['msg'],
+                                err_obj.FBD_LOAD_LOADED_403['status'])
+
+        # In array mode every commit also rewrites the boat, so leave room
+        # for it
+        size = const.MAX_COMMIT_ENTITIES
+        if LOADS_MODE == const.LOADS_ARRAY:
+            size -= 1
+
+        def put_batch_on_boat(batch):
+            # Check the boat and loads again as read in the transaction
+            boat = None
+            written = []
+            for entity in get_entities(
+                    [boat_key] + [client.key(const.LOADS, id)
+                                  for id in batch]):
+                if entity.key == boat_key:
+                    boat = entity
+                else:
+                    written.append(entity)
+            if boat is None or len(written) != len(batch):
+                return err_obj.NO_BOAT_LOAD_FOUND_404
+            for load in written:
+                if load['carrier'] is not None:
+                    return err_obj.FBD_LOAD_LOADED_403
+                load['carrier'] = int(boat.key.id)
+            if LOADS_MODE == const.LOADS_ARRAY:
+                boat['loads'].extend(batch)
+                written.insert(0, boat)
+            put_entities(written)
+            return None
+
+        for batch in batched(load_ids, size):
+            err = run_transaction(put_batch_on_boat, batch)
+            if err is not None:
+                return get_resp(err['msg'], err['status'])
+            for id in batch:
+                record_change('assign', const.LOADS, id, boat['owner'],
+                              boat_id)
+        return get_resp(None, 204)
+
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
+
+
 @app.route('/loads', methods=const.METHODS)
 def loads_post_get():
     """"""
@@ -559,17 +2074,13 @@ def loads_post_get():
             return get_resp(err_obj.WRONG_TYPE_415['msg'],
                             err_obj.WRONG_TYPE_415['status'])
 
-        if len(request.get_json()) < 3:
-            return get_resp(err_obj.MISS_ATTR_ONE_400['msg'],
-                            err_obj.MISS_ATTR_ONE_400['status'])
-
-        content = request.get_json()
-        new_load = create_entity(
-            const.LOADS,
-            {'volume': content['volume'],
-             'item': content['item'],
-             'creation_date': content['creation_date'],
-             'carrier': None})
+        try:
+            content = schemas.validate(const.LOADS, request)
+        except schemas.ValidationError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+
+        new_load = create_entity(const.LOADS, dict(content, carrier=None))
+        record_change('create', const.LOADS, new_load.key.id)
         new_load['id'] = new_load.key.id
         new_load['self'] = BASE_URL + '/loads/' + str(new_load.key.id)
         return get_resp(new_load, 201)
@@ -578,36 +2089,63 @@ def loads_post_get():
 
         # TODO: Add authorization
 
-        query = client.query(kind=const.LOADS)
+        try:
+            fields, embed = fieldsets.parse(const.LOADS, request.args)
+        except fieldsets.FieldsetError as err:
+            return get_resp(err.error['msg'], err.error['status'])
 
-        q_limit = int(request.args.get('limit', '5'))
-        q_offset = int(request.args.get('offset', '0'))
         query = client.query(kind=const.LOADS)
-        # Get a list of at most 5 loads from datastore
-        g_iterator = query.fetch(limit=q_limit, offset=q_offset)
-        pages = g_iterator.pages
-        loads = list(next(pages))
+        err = add_query_args(query, const.LOADS, fields=fields)
+        if err is not None:
+            return err
+        if wants_stream():
+            return get_stream_resp(representation.stream_array(
+                query.fetch(), lambda load: encode_load(load, fields),
+                '{"loads":[', ']}'))
+
+        # Get a page of at most 'limit' (default 5) loads from datastore
+        loads, next_url, pagination = fetch_page(query, '/loads')
+        if loads is None:
+            return get_resp(err_obj.BAD_CURSOR_400['msg'],
+                            err_obj.BAD_CURSOR_400['status'])
+
+        # Add pagination mode and next url, if not None, to the loads list
+        extra = {'pagination': pagination}
+        if next_url:
+            extra['next'] = next_url
+        if wants_total():
+            extra['total_items'] = cached_aggregate(
+                const.LOADS, None, query)['count']
 
-        # If there is another page, set next url using limit and offset
-        next_url = None
-        if g_iterator.next_page_token:
-            next_offset = q_offset + q_limit
-            next_url = BASE_URL + '/loads' + '?limit=' + str(
-                q_limit) + '&offset=' + str(next_offset)
+        # Loads are encoded with 'id' and 'self' added
+        return get_json_resp(
+            representation.page_json(
+                'loads', loads, lambda load: encode_load(load, fields),
+                extra), 200)
 
-        # Add 'id', 'self', and convert loads list for each load object
-        for load in loads:
-            load['id'] = load.key.id
-            # Convert any loads from ID value to dict with 'id', 'self'
-            load['self'] = BASE_URL + '/loads/' + str(load.key.id)
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
 
-        # Add list to dict
-        resp_body = {'loads': loads}
-        # Add next url to dict if not None
-        if next_url:
-            resp_body['next'] = next_url
 
-        return get_resp(loads, 200)
+@app.route('/loads/count', methods=const.METHODS)
+def loads_count():
+    """Count the loads that match the filters in the request args"""
+    if const.APP_JSON not in request.accept_mimetypes:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method == 'GET':
+
+        # TODO: Add authorization
+
+        query = client.query(kind=const.LOADS)
+        err = add_query_args(query, const.LOADS)
+        if err is not None:
+            return err
+        values = cached_aggregate(const.LOADS, None, query)
+        return get_resp({'count': values['count']}, 200)
 
     else:
         return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
@@ -626,53 +2164,281 @@ def load_del_get_put_patch(id):
 
         # TODO: Add authorization
 
+        # Check the body before any datastore work
+        if request.method == 'PATCH' or request.method == 'PUT':
+            if request.mimetype != const.APP_JSON:
+                return get_resp(err_obj.WRONG_TYPE_415['msg'],
+                                err_obj.WRONG_TYPE_415['status'])
+            try:
+                content = schemas.validate(const.LOADS, request,
+                                           partial=request.method == 'PATCH')
+            except schemas.ValidationError as err:
+                return get_resp(err.error['msg'], err.error['status'])
+
+        try:
+            fields, embed = fieldsets.parse(const.LOADS, request.args)
+        except fieldsets.FieldsetError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+
         load = get_entity(const.LOADS, int(id))
 
         if load is None:
             return get_resp(err_obj.NO_LOAD_FOUND_404['msg'],
                             err_obj.NO_LOAD_FOUND_404['status'])
 
+        # A PATCH body may hold only attributes the schema leaves out
+        if request.method == 'PATCH' and not content:
+            return get_resp(err_obj.MISS_ATTR_ALL_400['msg'],
+                            err_obj.MISS_ATTR_ALL_400['status'])
+
         if request.method == 'DELETE':
-            if load['carrier'] is not None:
-                boat = get_entity(const.BOATS, load['carrier'])
-                with client.transaction():
-                    boat['loads'].remove(int(id))
-                    client.put(boat)
-            client.delete(load)
+            def unload_and_delete():
+                load = get_entity(const.LOADS, int(id))
+                if load is None:
+                    return None
+                if load['carrier'] is not None and \
+                        LOADS_MODE == const.LOADS_ARRAY:
+                    boat = get_entity(const.BOATS, load['carrier'])
+                    if boat is not None and int(id) in boat['loads']:
+                        boat['loads'].remove(int(id))
+                        put_entity(boat)
+                delete_entity(load.key)
+                return load
+            load = run_transaction(unload_and_delete)
+            if load is not None:
+                record_change('delete', const.LOADS, id,
+                              boat_id=load['carrier'])
             return get_resp(None, 204)
 
-        elif request.method == 'PATCH':
-
-            if request.mimetype != const.APP_JSON:
-                return get_resp(err_obj.WRONG_TYPE_415['msg'],
-                                err_obj.WRONG_TYPE_415['status'])
-            keys = request.get_json().keys()
-            if len(keys) < 1:
-                return get_resp(err_obj.MISS_ATTR_ALL_400['msg'],
-                                err_obj.MISS_ATTR_ALL_400['status'])
-            with client.transaction():
-                for key in keys:
-                    load[key] = request.get_json()[key]
-                client.put(load)
-
-        elif request.method == 'PUT':
-            if request.mimetype != const.APP_JSON:
-                return get_resp(err_obj.WRONG_TYPE_415['msg'],
-                                err_obj.WRONG_TYPE_415['status'])
-            body = request.get_json()
-            if len(body) < 3:
-                return get_resp(err_obj.MISS_ATTR_ONE_400['msg'],
-                                err_obj.MISS_ATTR_ONE_400['status'])
-            with client.transaction():
-                load['volume'] = body['volume']
-                load['item'] = body['item']
-                load['creation_date'] = body['creation_date']
-                client.put(load)
+        elif request.method == 'PATCH' or request.method == 'PUT':
+            # PATCH and PUT differ only in the schema check above
+            def update_load():
+                load = get_entity(const.LOADS, int(id))
+                # It may have been deleted since it was read above
+                if load is None:
+                    return None, err_obj.NO_LOAD_FOUND_404
+                if not etag_matches(load):
+                    return None, err_obj.PRECONDITION_FAILED_412
+                load.update(content)
+                put_entity(load)
+                return load, None
+            load, err = run_transaction(update_load)
+            if err is not None:
+                return get_resp(err['msg'], err['status'])
+            record_change('update', const.LOADS, id)
 
         # Same block for 'GET', 'PATCH', and 'PUT'
+        etag = entity_etag(load)
+        matched = compression.matching_etag(etag, request.if_none_match)
+        if request.method == 'GET' and matched is not None:
+            return get_not_modified_resp(matched)
         load['id'] = load.key.id
         load['self'] = BASE_URL + '/boats/' + str(load.key.id)
-        return get_resp(load, 200)
+        return get_resp(fieldsets.select(load, fields), 200, etag=etag)
+
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
+
+
+def read_changes(cursor, limit, owner):
+    """Read the change records after cursor that owner may see. Records of
+    other users' boats are skipped
+
+    Return a tuple of (records, cursor after the last record read)
+    """
+    with metrics.timed('changes'):
+        records = change_log.read(cursor, limit)
+    if records:
+        cursor = records[-1]['seq']
+    return [r for r in records if r.get('owner') in (None, owner)], cursor
+
+
+def stream_changes(cursor, owner):
+    """Send the change records after cursor as Server-Sent Events for up to
+    CHANGES_STREAM_SECONDS. A client that reconnects with the Last-Event-ID
+    header carries on from the last record it was sent
+
+    Yield the text of each event
+    """
+    yield 'retry: 1000\n\n'
+    now = time.monotonic()
+    end = now + CHANGES_STREAM_SECONDS
+    last_sent = now
+    while now < end:
+        records, next_cursor = read_changes(cursor, const.MAX_CHANGES_PAGE,
+                                            owner)
+        for record in records:
+            yield 'id: %d\nevent: change\ndata: %s\n\n' % (
+                record['seq'], fast_json.dumps(changelog.public(record)))
+        now = time.monotonic()
+        if records:
+            last_sent = now
+        elif next_cursor != cursor or now - last_sent >= CHANGES_HEARTBEAT:
+            # An event with only an id moves the client's Last-Event-ID
+            # past records it may not see, and keeps the connection alive
+            yield 'id: %d\n\n' % next_cursor
+            last_sent = now
+        cursor = next_cursor
+        if len(records) < const.MAX_CHANGES_PAGE:
+            time.sleep(CHANGES_POLL_INTERVAL)
+            now = time.monotonic()
+
+
+@app.route('/changes', methods=const.METHODS)
+def changes_get():
+    """Read the changes made to boats and loads, in the order they were
+    made, after the cursor in the 'after' arg or the Last-Event-ID header.
+    Clients that accept text/event-stream get Server-Sent Events. Others
+    get a page of records, waiting up to 'wait' seconds for one if there
+    are none yet
+    """
+    mimetype = request.accept_mimetypes.best_match(
+        [const.APP_JSON, const.EVENT_STREAM])
+    if mimetype is None:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method == 'GET':
+        results = verify_jwt(request)
+        if results.err is not None:
+            return results.err
+        owner = results.payload['sub']
+
+        # 'now' skips the records made so far
+        after = request.args.get('after',
+                                 request.headers.get('Last-Event-ID', '0'))
+        try:
+            cursor = change_log.head() if after == 'now' else int(after)
+            limit = max(1, min(int(request.args.get('limit', '100')),
+                               const.MAX_CHANGES_PAGE))
+            wait = max(0.0, min(float(request.args.get('wait', '0')),
+                                CHANGES_MAX_WAIT))
+        except ValueError:
+            return get_resp(err_obj.BAD_CURSOR_400['msg'],
+                            err_obj.BAD_CURSOR_400['status'])
+
+        waiting = mimetype == const.EVENT_STREAM or wait > 0
+        if waiting and not change_waiters.enter():
+            return get_admission_error_resp(err_obj.OVERLOADED_503,
+                                            CHANGES_POLL_INTERVAL)
+
+        if mimetype == const.EVENT_STREAM:
+            response = Response(stream_changes(cursor, owner),
+                                mimetype=const.EVENT_STREAM,
+                                headers={'Cache-Control': 'no-cache',
+                                         'X-Accel-Buffering': 'no'})
+            response.call_on_close(change_waiters.leave)
+            return response
+
+        try:
+            deadline = time.monotonic() + wait
+            while True:
+                records, cursor = read_changes(cursor, limit, owner)
+                if records or time.monotonic() >= deadline:
+                    break
+                time.sleep(CHANGES_POLL_INTERVAL)
+        finally:
+            if waiting:
+                change_waiters.leave()
+        return get_resp({
+            'changes': [changelog.public(r) for r in records],
+            'cursor': str(cursor),
+            'next': BASE_URL + '/changes?' + urlencode(
+                {'after': cursor, 'limit': limit})
+        }, 200)
+
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
+
+
+@app.route('/boats:batch', methods=const.METHODS)
+def boats_batch():
+    """Create (POST), partially update (PATCH) or delete (DELETE) many of
+    the user's boats in one request. The body is a JSON array of boat
+    objects, of boat objects with an 'id', or of boat IDs respectively
+    """
+    if const.APP_JSON not in request.accept_mimetypes:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method in ('POST', 'PATCH', 'DELETE'):
+
+        if request.mimetype != const.APP_JSON:
+            return get_resp(err_obj.WRONG_TYPE_415['msg'],
+                            err_obj.WRONG_TYPE_415['status'])
+
+        try:
+            items = schemas.parse_body(request)
+        except schemas.ValidationError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+        err = check_batch(items)
+        if err is not None:
+            return err
+
+        results = verify_jwt(request)
+        if results.err is not None:
+            return results.err
+        owner = results.payload['sub']
+
+        if request.method == 'POST':
+            item_results = create_entities(const.BOATS, items,
+                                           new_boat_attrs(owner))
+            for result in item_results:
+                if result['status'] == 201:
+                    result.setdefault('loads', [])
+        elif request.method == 'PATCH':
+            item_results = update_entities(
+                const.BOATS, items, err_obj.NO_BOAT_FOUND_404,
+                owner, err_obj.FBD_BOAT_UPDATE_403)
+        else:
+            item_results = delete_boats(items, owner)
+        return get_resp({'results': item_results}, 200)
+
+    else:
+        return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
+                        err_obj.DISALLOWED_METHOD_405['status'])
+
+
+@app.route('/loads:batch', methods=const.METHODS)
+def loads_batch():
+    """Create (POST), partially update (PATCH) or delete (DELETE) many loads
+    in one request. The body is a JSON array of load objects, of load
+    objects with an 'id', or of load IDs respectively
+    """
+    if const.APP_JSON not in request.accept_mimetypes:
+        return get_resp(err_obj.WRONG_ACCEPT_406['msg'],
+                        err_obj.WRONG_ACCEPT_406['status'],
+                        False)
+
+    if request.method in ('POST', 'PATCH', 'DELETE'):
+
+        # TODO: Add authorization
+
+        if request.mimetype != const.APP_JSON:
+            return get_resp(err_obj.WRONG_TYPE_415['msg'],
+                            err_obj.WRONG_TYPE_415['status'])
+
+        try:
+            items = schemas.parse_body(request)
+        except schemas.ValidationError as err:
+            return get_resp(err.error['msg'], err.error['status'])
+        err = check_batch(items)
+        if err is not None:
+            return err
+
+        if request.method == 'POST':
+            item_results = create_entities(const.LOADS, items,
+                                           {'carrier': None})
+        elif request.method == 'PATCH':
+            item_results = update_entities(
+                const.LOADS, items, err_obj.NO_LOAD_FOUND_404)
+        else:
+            item_results = delete_loads(items)
+        return get_resp({'results': item_results}, 200)
 
     else:
         return get_resp(err_obj.DISALLOWED_METHOD_405['msg'],
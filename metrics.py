@@ -0,0 +1,172 @@
+# Request-scoped timing and Prometheus-style histograms for the API
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+
+class Histogram():
+    def __init__(self, buckets=BUCKETS):
+        """Initializes a cumulative histogram with the given bucket bounds"""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry():
+    def __init__(self):
+        """Initializes a store of request and phase histograms keyed by
+        their label values, plus phase call and transaction event counters
+        """
+        self.requests = {}
+        self.phases = {}
+        self.calls = {}
+        self.txn_events = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, method, seconds, timings):
+        """Record a finished request and the phases timed during it"""
+        with self._lock:
+            key = (route, method)
+            self.requests.setdefault(key, Histogram()).observe(seconds)
+            for phase, (spent, calls) in timings.items():
+                key = (route, phase)
+                self.phases.setdefault(key, Histogram()).observe(spent)
+                self.calls[key] = self.calls.get(key, 0) + calls
+
+    def count_txn_event(self, route, event):
+        """Count a transaction event, such as 'conflict' or 'retry', for
+        route
+        """
+        with self._lock:
+            key = (route, event)
+            self.txn_events[key] = self.txn_events.get(key, 0) + 1
+
+    def render(self, extra_lines=()):
+        """Format every metric in the Prometheus text exposition format
+
+        Return the text
+        """
+        lines = []
+        with self._lock:
+            lines.append('# HELP app_request_duration_seconds '
+                         'Request latency by route and method')
+            lines.append('# TYPE app_request_duration_seconds histogram')
+            for (route, method), hist in sorted(self.requests.items()):
+                labels = 'route="%s",method="%s"' % (route, method)
+                _render_histogram(lines, 'app_request_duration_seconds',
+                                  labels, hist)
+
+            lines.append('# HELP app_phase_duration_seconds '
+                         'Time spent per request in each phase by route')
+            lines.append('# TYPE app_phase_duration_seconds histogram')
+            for (route, phase), hist in sorted(self.phases.items()):
+                labels = 'route="%s",phase="%s"' % (route, phase)
+                _render_histogram(lines, 'app_phase_duration_seconds',
+                                  labels, hist)
+
+            lines.append('# HELP app_phase_calls_total '
+                         'Calls made in each phase by route')
+            lines.append('# TYPE app_phase_calls_total counter')
+            for (route, phase), calls in sorted(self.calls.items()):
+                lines.append('app_phase_calls_total{route="%s",phase="%s"} %d'
+                             % (route, phase, calls))
+
+            lines.append('# HELP app_transaction_events_total '
+                         'Transaction conflicts, retries and failures by '
+                         'route')
+            lines.append('# TYPE app_transaction_events_total counter')
+            for (route, event), count in sorted(self.txn_events.items()):
+                lines.append('app_transaction_events_total{route="%s",'
+                             'event="%s"} %d' % (route, event, count))
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(lines, name, labels, hist):
+    for bound, count in zip(hist.buckets, hist.counts):
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, hist.count))
+    lines.append('%s_sum{%s} %.6f' % (name, labels, hist.total))
+    lines.append('%s_count{%s} %d' % (name, labels, hist.count))
+
+
+registry = Registry()
+
+
+def route_label():
+    """Return the URL rule of the current request, used as its route label
+    """
+    if not has_request_context():
+        return 'none'
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def start_request():
+    """Start timing the current request"""
+    g.request_start = time.perf_counter()
+    g.timings = {}
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to phase for the current request.
+    Outside of a request the block runs untimed
+    """
+    if not has_request_context() or 'timings' not in g:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spent = time.perf_counter() - start
+        entry = g.timings.get(phase)
+        if entry is None:
+            g.timings[phase] = [spent, 1]
+        else:
+            entry[0] += spent
+            entry[1] += 1
+
+
+def finish_request(route, method, response):
+    """Record the current request in the registry and add a Server-Timing
+    header with its phase breakdown to response
+    """
+    if 'request_start' not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    timings = g.timings
+    registry.observe_request(route, method, total, timings)
+
+    parts = ['%s;dur=%.2f;desc="%d calls"' % (phase, spent * 1000, calls)
+             for phase, (spent, calls) in timings.items()]
+    parts.append('total;dur=%.2f' % (total * 1000))
+    response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def counter_lines(name, help_text, label, values):
+    """Format a dictionary of label value to count as a Prometheus counter
+
+    Return a list of lines
+    """
+    lines = ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+    for value, count in sorted(values.items()):
+        lines.append('%s{%s="%s"} %s' % (name, label, value, count))
+    return lines
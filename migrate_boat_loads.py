@@ -0,0 +1,121 @@
+# Converts stored boats between the two ways of storing their loads, set by
+# BOAT_LOADS_MODE in main.py
+#
+#   --to carrier  checks that each load in a boat's 'loads' list names the
+#                 boat as its 'carrier', sets it where it is missing, and
+#                 removes the list from the boat. Deploy with
+#                 BOAT_LOADS_MODE=carrier first; the list is unused then.
+#   --to array    rebuilds each boat's 'loads' list from the loads' 'carrier'
+#                 index. Run it after deploying BOAT_LOADS_MODE=array.
+#
+# Both directions can be run again safely, and --dry-run only reports.
+#
+# Usage: python migrate_boat_loads.py --to carrier [--dry-run]
+
+import argparse
+
+import const
+
+from google.cloud import datastore
+
+PAGE_SIZE = 200
+
+
+def boats(client):
+    """Yield every boat, a page at a time"""
+    cursor = None
+    while True:
+        query = client.query(kind=const.BOATS)
+        g_iterator = query.fetch(limit=PAGE_SIZE, start_cursor=cursor)
+        page = list(next(g_iterator.pages))
+        yield from page
+        cursor = g_iterator.next_page_token
+        if not page or cursor is None:
+            return
+
+
+def to_carrier(client, boat, dry_run):
+    """Make the loads in a boat's 'loads' list name it as their carrier and
+    drop the list
+
+    Return a tuple of (loads repaired, loads that are on another boat)
+    """
+    load_ids = boat.get('loads')
+    if load_ids is None:
+        return 0, 0
+    repaired = []
+    conflicts = 0
+    for i in range(0, len(load_ids), const.MAX_LOOKUP_KEYS):
+        keys = [client.key(const.LOADS, int(id))
+                for id in load_ids[i:i + const.MAX_LOOKUP_KEYS]]
+        for load in client.get_multi(keys):
+            if load['carrier'] is None:
+                load['carrier'] = boat.key.id
+                repaired.append(load)
+            elif load['carrier'] != boat.key.id:
+                print('load %s is listed on boat %s but carried by boat %s'
+                      % (load.key.id, boat.key.id, load['carrier']))
+                conflicts += 1
+    if dry_run:
+        return len(repaired), conflicts
+
+    for i in range(0, len(repaired), const.MAX_COMMIT_ENTITIES):
+        client.put_multi(repaired[i:i + const.MAX_COMMIT_ENTITIES])
+    with client.transaction():
+        current = client.get(boat.key)
+        if current is not None:
+            current.pop('loads', None)
+            client.put(current)
+    return len(repaired), conflicts
+
+
+def to_array(client, boat, dry_run):
+    """Store the IDs of the loads carrying a boat as its 'loads' list
+
+    Return the number of load IDs that changed
+    """
+    query = client.query(kind=const.LOADS)
+    query.add_filter('carrier', '=', boat.key.id)
+    query.keys_only()
+    load_ids = sorted(load.key.id for load in query.fetch())
+    changed = len(set(load_ids) ^ set(boat.get('loads') or []))
+    if dry_run or (changed == 0 and 'loads' in boat):
+        return changed
+
+    with client.transaction():
+        current = client.get(boat.key)
+        if current is not None:
+            current['loads'] = load_ids
+            client.put(current)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert how boats store the loads on them')
+    parser.add_argument('--to', required=True,
+                        choices=[const.LOADS_CARRIER, const.LOADS_ARRAY])
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report changes without writing them')
+    args = parser.parse_args()
+
+    client = datastore.Client()
+    count = 0
+    changed = 0
+    conflicts = 0
+    for boat in boats(client):
+        count += 1
+        if args.to == const.LOADS_CARRIER:
+            repaired, skipped = to_carrier(client, boat, args.dry_run)
+            changed += repaired
+            conflicts += skipped
+        else:
+            changed += to_array(client, boat, args.dry_run)
+
+    print('%d boats checked, %d loads %s, %d conflicts'
+          % (count, changed, 'to change' if args.dry_run else 'changed',
+             conflicts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Lazily created, per-process objects such as API clients
+
+import os
+import threading
+
+
+class ProcessLocal():
+    def __init__(self, factory):
+        """Initializes a stand-in for the object factory() returns. The
+        object is created on first use, and again the first time it is used
+        in a forked child, so a child never shares its parent's gRPC
+        channels or HTTP sessions
+
+        Attribute lookups are passed through to the object, so the stand-in
+        can be used wherever the object itself would be
+        """
+        self._factory = factory
+        self._obj = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def process_instance(self):
+        """Return the object for the current process, creating it first if
+        needed
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._obj = self._factory()
+                    self._pid = pid
+        return self._obj
+
+    def discard(self):
+        """Drop the object so the next use creates a new one"""
+        with self._lock:
+            self._obj = None
+            self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.process_instance(), name)
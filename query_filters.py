@@ -0,0 +1,143 @@
+# Parses filter and sort request args for collection routes and checks them
+# against the composite indexes declared in index.yaml
+
+import yaml
+
+import const
+import err_obj
+
+OPS = {'eq': '=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _carrier(value):
+    if value.lower() == 'null':
+        return None
+    return int(value)
+
+
+# Properties of each kind that may be filtered or sorted on, with the
+# function that converts a request arg to the stored value type
+FIELDS = {
+    const.BOATS: {'name': str, 'type': str, 'length': _number},
+    const.LOADS: {'volume': _number, 'item': str, 'creation_date': str,
+                  'carrier': _carrier}
+}
+
+
+# Error handling class
+class QueryError(Exception):
+    def __init__(self, error):
+        """Holds the err_obj error object describing why the filters or sort
+        order can't be used
+        """
+        self.error = error
+
+
+def load_indexes(path):
+    """Read the composite indexes declared in an index.yaml file
+
+    Return a list of (kind, [(property, direction), ...]) tuples
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    indexes = []
+    for index in config.get('indexes') or []:
+        props = [(p['name'], p.get('direction', 'asc'))
+                 for p in index['properties']]
+        indexes.append((index['kind'], props))
+    return indexes
+
+
+def parse(kind, args):
+    """Read filters and a sort order for kind from request args. A filter is
+    sent as 'prop=value' or 'prop.op=value', where op is one of eq, lt,
+    lte, gt or gte, and the sort order as 'sort=prop,-prop2'. Args that
+    don't name a filterable property are ignored
+
+    Return a tuple of ([(prop, op, value), ...], [(prop, direction), ...])
+    """
+    fields = FIELDS[kind]
+    filters = []
+    for arg, value in args.items(multi=True):
+        prop, _, op = arg.partition('.')
+        if prop not in fields:
+            continue
+        op = op or 'eq'
+        if op not in OPS:
+            raise QueryError(err_obj.INVALID_FILTER_400)
+        try:
+            filters.append((prop, OPS[op], fields[prop](value)))
+        except ValueError:
+            raise QueryError(err_obj.INVALID_FILTER_400)
+
+    orders = []
+    for name in args.get('sort', '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        direction = 'asc'
+        if name.startswith('-'):
+            name, direction = name[1:], 'desc'
+        if name not in fields:
+            raise QueryError(err_obj.INVALID_FILTER_400)
+        orders.append((name, direction))
+    return filters, orders
+
+
+def plan(kind, filters, orders, indexes, equalities=()):
+    """Work out the sort order datastore needs for filters and orders, and
+    check that an index exists to serve them. equalities names properties
+    the route already filters on, such as a boat's 'owner'
+
+    Return the full list of (prop, direction) sort orders to apply
+    """
+    equal = set(equalities)
+    inequal = set()
+    for prop, op, value in filters:
+        if op == '=':
+            equal.add(prop)
+        else:
+            inequal.add(prop)
+    if len(inequal) > 1:
+        raise QueryError(err_obj.INVALID_FILTER_400)
+
+    # Sorting on a property held equal by a filter has no effect
+    orders = [(p, d) for p, d in orders if p not in equal]
+    if inequal:
+        prop = next(iter(inequal))
+        if not orders:
+            orders = [(prop, 'asc')]
+        elif orders[0][0] != prop:
+            # Datastore sorts on the inequality property first
+            raise QueryError(err_obj.INVALID_FILTER_400)
+
+    props = equal | set(p for p, d in orders)
+    # Built-in indexes serve single-property queries and equality-only
+    # queries, which datastore answers with a merge join
+    if len(props) <= 1 or not orders:
+        return orders
+
+    for index_kind, index_props in indexes:
+        if index_kind != kind or len(index_props) != len(equal) + len(orders):
+            continue
+        head = index_props[:len(equal)]
+        if set(p for p, d in head) == equal and \
+                index_props[len(equal):] == orders:
+            return orders
+    raise QueryError(err_obj.INDEX_REQUIRED_400)
+
+
+def apply(query, filters, orders):
+    """Add filters and sort orders to a datastore query"""
+    for prop, op, value in filters:
+        query.add_filter(prop, op, value)
+    if orders:
+        query.order = [p if d == 'asc' else '-' + p for p, d in orders]
+    return query
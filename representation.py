@@ -0,0 +1,119 @@
+# Serializes boats straight to JSON text from their stored load ID lists
+
+import functools
+import json
+
+import fast_json
+import fieldsets
+
+
+@functools.lru_cache(maxsize=8)
+def _load_ref_template(base_url):
+    """Build the %-format template for one load reference under base_url"""
+    prefix = json.dumps(base_url + '/loads/')[:-1]
+    return '{"id":%d,"self":' + prefix + '%d"}'
+
+
+def load_refs(load_ids, base_url):
+    """Build the list of {'id', 'self'} dictionaries for a boat's loads, for
+    responses that still need Python objects
+    """
+    prefix = base_url + '/loads/'
+    return [{'id': int(id), 'self': prefix + str(id)} for id in load_ids]
+
+
+def load_refs_json(load_ids, base_url):
+    """Encode a boat's load IDs as a JSON array of load references without
+    building an intermediate dictionary for each load
+    """
+    template = _load_ref_template(base_url)
+    return '[' + ','.join([template % (id, id) for id in load_ids]) + ']'
+
+
+def boat_json(boat, base_url, load_ids=None, fields=None, loads=None):
+    """Encode a boat entity with its 'id', 'self' and load references. The
+    references come from load_ids if given, or else from the boat's 'loads'
+    list. If loads is given, the full load entities are embedded instead.
+    If fields is given, only those attributes and 'id' and 'self' are
+    encoded. The entity itself is not modified
+
+    Return the JSON text
+    """
+    props = {k: v for k, v in boat.items() if k != 'loads'}
+    props['id'] = boat.key.id
+    props['self'] = base_url + '/boats/' + str(boat.key.id)
+    body = fast_json.dumps(fieldsets.select(props, fields))
+    if fields is not None and 'loads' not in fields:
+        return body
+    if loads is not None:
+        refs = '[' + ','.join([load_json(load, base_url)
+                               for load in loads]) + ']'
+    else:
+        if load_ids is None:
+            load_ids = boat.get('loads') or []
+        refs = load_refs_json(load_ids, base_url)
+    return body[:-1] + ',"loads":' + refs + '}'
+
+
+def load_json(load, base_url, fields=None):
+    """Encode a load entity with its 'id' and 'self'. If fields is given,
+    only those attributes and 'id' and 'self' are encoded. The entity itself
+    is not modified
+
+    Return the JSON text
+    """
+    props = dict(load)
+    props['id'] = load.key.id
+    props['self'] = base_url + '/loads/' + str(load.key.id)
+    return fast_json.dumps(fieldsets.select(props, fields))
+
+
+def user_json(user):
+    """Encode a user entity with its 'id'
+
+    Return the JSON text
+    """
+    props = dict(user)
+    props['id'] = user.key.id_or_name
+    return fast_json.dumps(props)
+
+
+def page_json(name, entities, encode, extra):
+    """Encode a page of entities as {name: [...]} plus the attributes in
+    extra, such as 'next' and 'pagination'. encode turns one entity into
+    its JSON text
+
+    Return the JSON text
+    """
+    parts = ['{', json.dumps(name), ':[',
+             ','.join([encode(entity) for entity in entities]), ']']
+    for key in sorted(extra):
+        parts.append(',' + json.dumps(key) + ':'
+                     + fast_json.dumps(extra[key]))
+    parts.append('}')
+    return ''.join(parts)
+
+
+def stream_array(entities, encode, prefix='[', suffix=']',
+                 chunk_size=16384):
+    """Encode entities as a JSON array, one at a time as the iterator
+    yields them, so the whole collection is never held in memory. Output is
+    gathered into chunks of about chunk_size characters before it is
+    yielded
+
+    Yield pieces of the JSON text
+    """
+    buf = [prefix]
+    size = len(prefix)
+    sep = ''
+    for entity in entities:
+        text = sep + encode(entity)
+        sep = ','
+        buf.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    buf.append(suffix + '\n')
+    yield ''.join(buf)
@@ -0,0 +1,76 @@
+# Declarative schemas for boat and load request bodies, checked before any
+# authentication or datastore work is done for a request
+
+import const
+import err_obj
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _text(value):
+    return isinstance(value, str)
+
+
+# Attributes a client may set on each kind, with the check each value must
+# pass. Attributes the API sets itself, such as 'owner', 'loads' and
+# 'carrier', are not listed and can't be set through a request body
+FIELDS = {
+    const.BOATS: {'name': _text, 'type': _text, 'length': _number},
+    const.LOADS: {'volume': _number, 'item': _text, 'creation_date': _text}
+}
+
+
+# Error handling class
+class ValidationError(Exception):
+    def __init__(self, error):
+        """Holds the err_obj error object describing why the request body
+        was rejected
+        """
+        self.error = error
+
+
+def parse_body(req):
+    """Parse the JSON body of a request. Flask keeps the parsed body, so
+    later calls to req.get_json() don't parse it again
+
+    Return the body, which may be any JSON value
+    """
+    body = req.get_json(silent=True)
+    if body is None:
+        raise ValidationError(err_obj.INVALID_BODY_400)
+    return body
+
+
+def check_item(kind, item, partial=False):
+    """Check one object against the schema of kind. Every attribute is
+    required, unless partial is True, in which case the object must not be
+    empty. Attributes that are not in the schema are left out
+
+    Return a dictionary of the schema attributes in item
+    """
+    fields = FIELDS[kind]
+    if not isinstance(item, dict):
+        raise ValidationError(err_obj.INVALID_BODY_400)
+    if partial:
+        if len(item) < 1:
+            raise ValidationError(err_obj.MISS_ATTR_ALL_400)
+    elif any(name not in item for name in fields):
+        raise ValidationError(err_obj.MISS_ATTR_ONE_400)
+
+    values = {}
+    for name, check in fields.items():
+        if name in item:
+            if not check(item[name]):
+                raise ValidationError(err_obj.INVALID_ATTR_400)
+            values[name] = item[name]
+    return values
+
+
+def validate(kind, req, partial=False):
+    """Parse a request body once and check it against the schema of kind
+
+    Return a dictionary of the schema attributes in the body
+    """
+    return check_item(kind, parse_body(req), partial)
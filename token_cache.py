@@ -0,0 +1,133 @@
+# A bounded LRU cache of verified JWT payloads keyed by bearer token digest
+
+import hashlib
+import json
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TokenCache():
+    def __init__(self, max_size=10000, max_bytes=16 * 1024 * 1024,
+                 sweep_interval=60):
+        """Initializes a cache that maps the SHA-256 digest of an access
+        token to its decoded and already verified payload.
+
+        Entries expire at the token's exp claim. When either max_size
+        entries or roughly max_bytes of payload data are held, the least
+        recently used entries are evicted first. Tokens without an exp
+        claim are never cached. Expired entries are also swept out at most
+        once every sweep_interval seconds.
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._next_sweep = time.time() + sweep_interval
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def _remove(self, digest):
+        """Remove an entry. Must be called with the lock held"""
+        payload, exp, size = self._entries.pop(digest)
+        self._bytes -= size
+
+    def get(self, token):
+        """Look up a verified payload for token
+
+        Return the payload dictionary, or None if the token is unknown or
+        its exp claim has passed
+        """
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, exp, size = entry
+            if time.time() >= exp:
+                self._remove(digest)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return payload
+
+    def peek(self, token):
+        """Look up a verified payload for token without counting a hit or
+        miss or marking the entry as recently used
+
+        Return the payload dictionary, or None if the token is unknown or
+        its exp claim has passed
+        """
+        with self._lock:
+            entry = self._entries.get(self._digest(token))
+        if entry is None or time.time() >= entry[1]:
+            return None
+        return entry[0]
+
+    def put(self, token, payload):
+        """Store a verified payload for token until its exp claim"""
+        exp = payload.get('exp')
+        if exp is None:
+            return
+        size = len(token) + len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (payload, exp, size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used entries until the
+        cache fits its limits. Must be called with the lock held
+        """
+        now = time.time()
+        if now >= self._next_sweep:
+            expired = [d for d, e in self._entries.items() if e[1] <= now]
+            for digest in expired:
+                self._remove(digest)
+                self.evictions += 1
+            self._next_sweep = now + self.sweep_interval
+        while (len(self._entries) > self.max_size
+               or self._bytes > self.max_bytes):
+            digest = next(iter(self._entries))
+            self._remove(digest)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def hit_rate(self):
+        """Return the fraction of lookups that were served from the cache"""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def stats(self):
+        """Return a dictionary of cache counters and sizes"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate(),
+            'size': len(self._entries),
+            'bytes': self._bytes
+        }
@@ -0,0 +1,130 @@
+# Delivers change log records to a webhook URL in batches, retrying failed
+# deliveries with exponential backoff
+
+import hashlib
+import hmac
+import queue
+import random
+import threading
+import time
+
+import requests
+
+import fast_json
+
+
+class WebhookSender():
+    def __init__(self, url, secret=None, batch_size=100, interval=1.0,
+                 max_attempts=5, backoff_base=0.5, backoff_max=30.0,
+                 timeout=5.0, max_queued=10000):
+        """Initializes a sender that POSTs {"changes": [...]} to url from a
+        background thread. A batch holds at most batch_size records and is
+        sent at most interval seconds after its first record was queued.
+
+        A batch that fails with a connection error, a 5xx or a 429 is sent
+        again, up to max_attempts times in all, after an exponential
+        backoff with jitter. Other responses are final. If secret is set,
+        each request carries an X-Webhook-Signature header holding the
+        HMAC-SHA256 of the body. At most max_queued records wait to be
+        sent, and records queued beyond that are dropped and counted
+        """
+        self.url = url
+        self.secret = secret
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.counts = {'delivered': 0, 'retried': 0, 'failed': 0,
+                       'dropped': 0}
+        self._queue = queue.Queue(max_queued)
+        self._session = requests.Session()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _count(self, event, n=1):
+        with self._lock:
+            self.counts[event] += n
+
+    def enqueue(self, records):
+        """Queue records for delivery, starting the sending thread first if
+        this is the first use
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self._count('dropped')
+
+    def flush(self, timeout=None):
+        """Wait until every queued record was delivered or given up on
+
+        Return True if the queue was emptied within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=wait))
+                except queue.Empty:
+                    break
+            self.deliver(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def deliver(self, batch):
+        """POST one batch of records, retrying as described above
+
+        Return True if the webhook accepted the batch
+        """
+        body = fast_json.dumps({'changes': batch}).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            digest = hmac.new(self.secret.encode('utf-8'), body,
+                              hashlib.sha256).hexdigest()
+            headers['X-Webhook-Signature'] = 'sha256=' + digest
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                resp = self._session.post(self.url, data=body,
+                                          headers=headers,
+                                          timeout=self.timeout)
+                if resp.status_code < 300:
+                    self._count('delivered', len(batch))
+                    return True
+                retry = resp.status_code >= 500 or resp.status_code == 429
+            except requests.RequestException:
+                retry = True
+            if not retry or attempt == self.max_attempts:
+                break
+            self._count('retried')
+            delay = min(self.backoff_max,
+                        self.backoff_base * 2 ** (attempt - 1))
+            time.sleep(random.uniform(delay / 2, delay))
+        self._count('failed', len(batch))
+        return False
+
+    def stats(self):
+        """Return a dictionary of delivery counters, in records except for
+        'retried', which counts batch attempts
+        """
+        with self._lock:
+            return dict(self.counts)